@@ -171,9 +171,13 @@ async function handleDone(req: Request): Promise<Response> {
   log.server("JOB_DONE " + body.jobId + " [task:" + body.taskId + "] success=" + body.success);
   obs.broadcast({ type: "JOB_DONE", payload: body });
 
-  // Use the Vercel deployment URL if available, fall back to repo URL
-  const deployUrl = state.deploymentUrls.get(body.jobId) ?? body.repoUrl;
-  state.results.push({ url: deployUrl, idea: body.idea ?? "", pitch: body.pitch ?? "", repoUrl: body.repoUrl });
+  // Cancelled jobs still count toward completion but are never evaluated
+  const cancelled = body.stopped === "cancelled";
+  if (!cancelled) {
+    // Use the Vercel deployment URL if available, fall back to repo URL
+    const deployUrl = state.deploymentUrls.get(body.jobId) ?? body.repoUrl;
+    state.results.push({ url: deployUrl, idea: body.idea ?? "", pitch: body.pitch ?? "", repoUrl: body.repoUrl });
+  }
 
   state.completedJobs.set(body.repoUrl, (state.completedJobs.get(body.repoUrl) ?? 0) + 1);
 
@@ -182,12 +186,16 @@ async function handleDone(req: Request): Promise<Response> {
   log.server("progress " + repoCompletedJobs + " / " + repoJobs);
 
   if (repoCompletedJobs >= repoJobs) {
-    log.server("all implementations done for " + body.repoUrl + ", firing evaluator webhook");
     const taskId = body.taskId;
     const evaluator = state.evaluators.get(body.repoUrl) ?? null;
     const builds = state.results
       .filter((r) => r.repoUrl === body.repoUrl)
       .map((r) => ({ url: r.url, idea: r.idea, pitch: r.pitch }));
+    if (builds.length === 0) {
+      log.server("all implementations for " + body.repoUrl + " were cancelled, skipping evaluator webhook");
+      return corsJson({ ok: true });
+    }
+    log.server("all implementations done for " + body.repoUrl + ", firing evaluator webhook");
     const allDonePayload = { taskId, evaluator, builds };
     obs.broadcast({ type: "ALL_DONE", payload: allDonePayload });
     await state.onAllDone?.(allDonePayload);
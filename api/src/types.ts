@@ -123,6 +123,14 @@ export interface JobStepLogPayload {
   done: boolean;
   /** Concise label for the pipeline node (e.g. "Installing dependencies") */
   summary: string;
+  /** Local build/serve check run before deploying; passed null is inconclusive */
+  verify?: {
+    passed: boolean | null;
+    build?: { status: string; seconds?: number; error?: string };
+    bundleBytes?: number;
+    serve?: { status: string; seconds?: number };
+    routes?: { route: string; status: number | null; ms: number | null; error?: string }[];
+  };
 }
 
 /** Job finished */
@@ -137,6 +145,40 @@ export interface JobDonePayload {
   success: boolean;
   error?: string;
   branch?: string;
+  /** Set when the worker was stopped early (e.g. "pruned", "budget") */
+  stopped?: string;
+  /** Pre-built project template used for the workspace, with time saved */
+  template?: {
+    stack: string;
+    hash: string;
+    contentHash: string;
+    copySeconds: number;
+    scaffoldSeconds: number | null;
+    savedSeconds: number;
+  };
+  /** Provider failovers during the run and time lost to retries */
+  providerRetries?: {
+    attempts: number;
+    failovers: Record<string, unknown>[];
+    timeLostSeconds: number;
+  };
+  /** Sandbox resource usage summary (peaks, p95, downsampled series) */
+  resources?: Record<string, unknown> | null;
+  /** Workspace manifest: file sizes, build output dirs, build/lint/test status */
+  manifest?: {
+    files: Record<string, number>;
+    fileCount: number;
+    totalBytes: number;
+    checks: Record<string, { status: string; seconds?: number }>;
+    buildOutputs: string[];
+  };
+  /** Content-addressed artifact tarball (manifest, check logs, PITCH.md, build output) */
+  artifact?: {
+    sha256: string;
+    bytes: number;
+    compression: "zstd" | "gzip";
+    uri: string;
+  };
 }
 
 /** Non-fatal error during job execution (e.g. git push failed) */
@@ -146,7 +188,7 @@ export interface JobErrorPayload {
   error: string;
   /** Raw stderr from the failed command */
   stderr?: string;
-  /** Which phase failed (e.g. "git_init", "git_push", "agent") */
+  /** Which phase failed (e.g. "git_init", "git_push", "agent", "provider_failover") */
   phase?: string;
 }
 
@@ -157,6 +199,11 @@ export interface JobPushPayload {
   stepIndex: number;
   branch: string;
   summary: string;
+  /** Files and bytes staged for this commit */
+  filesStaged?: number;
+  bytesStaged?: number;
+  /** Paths kept out of the commit by the size/type policy → reason */
+  diverted?: Record<string, string>;
 }
 
 /** Vercel deployment URL available */
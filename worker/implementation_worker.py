@@ -4,8 +4,21 @@ Trigger endpoint + Sandbox that runs Claude Code CLI via runner.py.
 Skills and treemux-report tool are uploaded to the sandbox.
 """
 
+import asyncio
+import functools
+import gzip
+import hashlib
+import io
 import json
 import os
+import queue
+import re
+import shlex
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
 from pathlib import Path
 
 import modal
@@ -15,13 +28,53 @@ app = modal.App("treemux-implementation")
 
 _WORKER_DIR = Path(__file__).resolve().parent
 
+# ── Project templates: one pre-scaffolded workspace per stack ──
+# Built into the sandbox image (so Modal caches each as an image layer) and
+# copied into /workspace by runner.py before the CLI starts. Scaffolders
+# are pinned so the recipe hash changes (and the layer rebuilds) whenever
+# what they generate can. The manifest records the recipe hash, which
+# runner.py checks for freshness, a hash of package.json plus the lockfile,
+# which runner.py checks against the snapshot it copies, and how long
+# scaffolding took, which is reported as time saved per job.
+# Bump a version here to pick up a new scaffolder release.
+_TEMPLATES_DIR = "/opt/templates"
+_TEMPLATE_RECIPES = {
+    "nextjs-shadcn": [
+        'bunx create-next-app@16.0.0 . --yes --typescript --tailwind --eslint --app --src-dir --no-react-compiler --import-alias "@/*" --turbopack --use-bun --disable-git',
+        "bunx shadcn@3.2.1 init -d -y --force",
+        "bunx shadcn@3.2.1 add button card input -y --overwrite",
+    ],
+    "vite-react": [
+        "bunx create-vite@7.1.1 . --template react-ts --no-interactive",
+        "bun install",
+    ],
+}
+_DEFAULT_STACK = "nextjs-shadcn"
+
+
+def _template_hash(stack: str) -> str:
+    return hashlib.sha256(json.dumps(_TEMPLATE_RECIPES[stack]).encode()).hexdigest()[:16]
+
+
+def _template_build_command(stack: str) -> str:
+    """Shell command that scaffolds a template as the agent user."""
+    dest = "%s/%s" % (_TEMPLATES_DIR, stack)
+    script = (
+        "set -e; mkdir -p %s; cd %s; start=$(date +%%s); %s; rm -rf .git .gitignore; "
+        "content=$(cat package.json $(ls bun.lock bun.lockb 2>/dev/null) | sha256sum | cut -c1-16); "
+        "printf '{\"stack\": \"%s\", \"hash\": \"%s\", \"content_hash\": \"%%s\", \"scaffold_s\": %%s}' "
+        "$content $(( $(date +%%s) - start )) > %s.json"
+    ) % (dest, dest, "; ".join(_TEMPLATE_RECIPES[stack]), stack, _template_hash(stack), dest)
+    return "runuser -u agent -- bash -c %s" % shlex.quote(script)
+
+
 # ── Sandbox image: Ubuntu 22.04, Node.js 22, bun, uv, Claude Code CLI ──
 _sandbox_image = (
     modal.Image.from_registry("ubuntu:22.04")
     .env({"DEBIAN_FRONTEND": "noninteractive"})
     .apt_install(
         "wget", "ca-certificates", "curl", "net-tools", "iproute2",
-        "git", "build-essential", "unzip",
+        "git", "build-essential", "unzip", "zstd",
         "python3", "python3-pip", "python3-venv", "python-is-python3",
     )
     # Node.js 22
@@ -49,6 +102,11 @@ _sandbox_image = (
         "ln -sf /home/agent/.local/bin/claude /usr/local/bin/claude",
     )
     .env({"PATH": "/usr/local/bin:/usr/bin:/bin:/usr/sbin:/sbin"})
+    # Project templates with dependencies installed
+    .run_commands(
+        "mkdir -p %s && chown agent:agent %s" % (_TEMPLATES_DIR, _TEMPLATES_DIR),
+        *[_template_build_command(stack) for stack in _TEMPLATE_RECIPES],
+    )
 )
 
 # ── Function image: lightweight Python + files to upload to sandbox ──
@@ -78,6 +136,18 @@ if _skills_dir.exists():
     )
 
 
+# Per-job tool-call traces, uploaded once when the job ends.
+# Download with `modal volume get treemux-traces / ./traces` and query
+# with scripts/trace_query.py.
+_traces_volume = modal.Volume.from_name("treemux-traces", create_if_missing=True)
+_TRACES_DIR = "/traces"
+
+# Done-stage artifact blobs (manifest, check logs, build output), written
+# by `treemux-report done` and referenced from the done callback by sha256.
+_artifacts_volume = modal.Volume.from_name("treemux-artifacts", create_if_missing=True)
+_ARTIFACTS_DIR = "/artifacts"
+
+
 def _log(msg: str) -> None:
     print("[worker] %s" % msg, flush=True)
 
@@ -121,7 +191,221 @@ def _summarize_tool_input(tool_name, tool_input):
         return s[:100] + "..." if len(s) > 100 else s
 
 
-def stream_agent_output(process):
+def _content_size(content) -> int:
+    if isinstance(content, str):
+        return len(content)
+    return len(json.dumps(content))
+
+
+class ToolTrace:
+    """Record every tool call of a job as gzip JSONL segments.
+
+    Records are queued by the stream loop and written by a background
+    thread, so tracing never blocks log streaming. Each record holds the
+    tool name, input hash/size, duration, error flag and output size.
+    """
+
+    SEGMENT_RECORDS = 500
+
+    def __init__(self):
+        self._dir = tempfile.mkdtemp(prefix="treemux-trace-")
+        self._pending = {}
+        self._queue = queue.Queue()
+        self._segments = []
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def tool_use(self, block) -> None:
+        raw = json.dumps(block.get("input", {}), sort_keys=True).encode()
+        self._pending[block.get("id", "")] = {
+            "ts": round(time.time(), 3),
+            "tool": block.get("name", "?"),
+            "in_hash": hashlib.sha1(raw).hexdigest()[:16],
+            "in_bytes": len(raw),
+            "_start": time.monotonic(),
+        }
+
+    def tool_result(self, block) -> None:
+        record = self._pending.pop(block.get("tool_use_id", ""), None)
+        if record is None:
+            return
+        record["ms"] = round((time.monotonic() - record.pop("_start")) * 1000)
+        record["err"] = bool(block.get("is_error", False))
+        record["out_bytes"] = _content_size(block.get("content", ""))
+        self._queue.put(record)
+
+    def _write_loop(self) -> None:
+        out, count = None, 0
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            if out is None or count >= self.SEGMENT_RECORDS:
+                if out is not None:
+                    out.close()
+                path = os.path.join(self._dir, "seg-%05d.jsonl.gz" % len(self._segments))
+                self._segments.append(path)
+                out, count = gzip.open(path, "wt"), 0
+            out.write(json.dumps(record, separators=(",", ":")) + "\n")
+            count += 1
+        if out is not None:
+            out.close()
+
+    def close(self, dest: str) -> int:
+        """Flush calls that never got a result and write all segments to dest.
+
+        Gzip members concatenate into a valid gzip stream, so the segments
+        are appended as-is. Returns the number of segments written.
+        """
+        for record in self._pending.values():
+            record.pop("_start")
+            record.update(ms=None, err=None, out_bytes=None)
+            self._queue.put(record)
+        self._pending.clear()
+        self._queue.put(None)
+        self._thread.join()
+        if self._segments:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, "wb") as out:
+                for path in self._segments:
+                    with open(path, "rb") as seg:
+                        shutil.copyfileobj(seg, out)
+        shutil.rmtree(self._dir, ignore_errors=True)
+        return len(self._segments)
+
+
+_BUILD_CMD = re.compile(r"\b(run build|next build|vite build|tsc)\b")
+
+
+class StreamRecorder:
+    """Tee a sandbox process's raw stdout into a gzip file.
+
+    Recordings are replayed offline through stream_agent_output by
+    scripts/replay_stream.py, so parser changes can be checked against
+    real Claude CLI output.
+    """
+
+    def __init__(self, process):
+        self._process = process
+        self._dir = tempfile.mkdtemp(prefix="treemux-stream-")
+        self._path = os.path.join(self._dir, "stdout.gz")
+        self._out = gzip.open(self._path, "wt")
+        self.lines = 0
+
+    @property
+    def stdout(self):
+        for line in self._process.stdout:
+            self._out.write(line)
+            self.lines += 1
+            yield line
+
+    def close(self, dest: str) -> int:
+        """Write the recording to dest and return the number of lines."""
+        self._out.close()
+        if self.lines:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(self._path, dest)
+        shutil.rmtree(self._dir, ignore_errors=True)
+        return self.lines
+
+
+class JobProgress:
+    """Live progress signals for a job, derived from the tool-call stream.
+
+    Steps are counted from successful `treemux-report step` calls and build
+    errors from failed build commands, so the pruning controller sees the
+    same milestones the orchestrator receives as callbacks.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.tool_calls = 0
+        self.tool_errors = 0
+        self.steps = 0
+        self.builds = 0
+        self.build_errors = 0
+        self.last_step_at = None
+        self._kinds = {}
+
+    def tool_use(self, block) -> None:
+        self.tool_calls += 1
+        if block.get("name") != "Bash":
+            return
+        command = block.get("input", {}).get("command", "")
+        if "treemux-report step" in command:
+            self._kinds[block.get("id", "")] = "step"
+        elif _BUILD_CMD.search(command):
+            self._kinds[block.get("id", "")] = "build"
+
+    def tool_result(self, block) -> None:
+        is_error = bool(block.get("is_error", False))
+        self.tool_errors += 1 if is_error else 0
+        kind = self._kinds.pop(block.get("tool_use_id", ""), None)
+        if kind == "step" and not is_error:
+            self.steps += 1
+            self.last_step_at = time.time()
+        elif kind == "build":
+            self.builds += 1
+            self.build_errors += 1 if is_error else 0
+
+    def snapshot(self) -> dict:
+        elapsed = time.time() - self.started
+        return {
+            "elapsed_s": round(elapsed),
+            "steps": self.steps,
+            # Steps per 10 minutes
+            "step_rate": round(self.steps * 600 / max(elapsed, 60), 3),
+            "idle_s": round(time.time() - (self.last_step_at or self.started)),
+            "tool_calls": self.tool_calls,
+            "tool_errors": self.tool_errors,
+            "tool_error_ratio": round(self.tool_errors / self.tool_calls, 3) if self.tool_calls else 0.0,
+            "builds": self.builds,
+            "build_errors": self.build_errors,
+        }
+
+
+class JobMetrics:
+    """Fleet metrics observed by one job, published with its progress.
+
+    The `metrics` endpoint aggregates them across all jobs. Push latency
+    and callback failures inside the sandbox are recorded by
+    treemux-report and merged in when the job ends.
+    """
+
+    def __init__(self):
+        self.sandbox_create_s = None
+        self.reserved = False
+        self.exec_started = None
+        self.first_token_s = None
+        self.cost_usd = 0.0
+        self.push_s = []
+        self.callback_failures = 0
+
+    def message(self, msg_type: str, msg: dict) -> None:
+        if msg_type == "assistant" and self.first_token_s is None and self.exec_started:
+            self.first_token_s = round(time.monotonic() - self.exec_started, 2)
+        elif msg_type == "result":
+            cost = msg.get("total_cost_usd", msg.get("cost_usd"))
+            if isinstance(cost, (int, float)):
+                self.cost_usd += cost
+
+    def merge_sandbox(self, metrics: dict) -> None:
+        """Merge treemux-report's counters from the sandbox state file."""
+        self.push_s += metrics.get("pushSeconds") or []
+        self.callback_failures += metrics.get("callbackFailures") or 0
+
+    def snapshot(self) -> dict:
+        return {
+            "sandbox_create_s": self.sandbox_create_s,
+            "reserved": self.reserved,
+            "first_token_s": self.first_token_s,
+            "cost_usd": round(self.cost_usd, 4),
+            "push_s": self.push_s,
+            "callback_failures": self.callback_failures,
+        }
+
+
+def stream_agent_output(process, trace=None, progress=None, metrics=None):
     """Stream and log agent messages from sandbox process stdout."""
     for line in process.stdout:
         line = line.strip()
@@ -134,6 +418,8 @@ def stream_agent_output(process):
             continue
 
         msg_type = msg.get("type", "unknown")
+        if metrics is not None:
+            metrics.message(msg_type, msg)
 
         if msg_type == "assistant":
             message = msg.get("message", {})
@@ -149,6 +435,10 @@ def stream_agent_output(process):
                         tool_input = block.get("input", {})
                         summary = _summarize_tool_input(name, tool_input)
                         _log("[tool_call] %s(%s)" % (name, summary))
+                        if trace is not None:
+                            trace.tool_use(block)
+                        if progress is not None:
+                            progress.tool_use(block)
                     elif btype == "thinking":
                         thinking = block.get("thinking", "")
                         _log("[thinking] %s..." % thinking[:100])
@@ -169,6 +459,10 @@ def stream_agent_output(process):
                             preview = str(content)[:200]
                         prefix = "tool_error" if is_error else "tool_result"
                         _log("[%s] %s" % (prefix, preview))
+                        if trace is not None:
+                            trace.tool_result(block)
+                        if progress is not None:
+                            progress.tool_result(block)
 
         elif msg_type == "result":
             cost = msg.get("cost_usd", msg.get("total_cost_usd", "?"))
@@ -176,6 +470,14 @@ def stream_agent_output(process):
             is_error = msg.get("is_error", False)
             status = "ERROR" if is_error else "SUCCESS"
             _log("[result] %s | Cost: $%s | Turns: %s" % (status, cost, turns))
+            usage = msg.get("usage")
+            if isinstance(usage, dict):
+                _log("[usage] input: %s | output: %s | cache read: %s | cache write: %s" % (
+                    usage.get("input_tokens", 0),
+                    usage.get("output_tokens", 0),
+                    usage.get("cache_read_input_tokens", 0),
+                    usage.get("cache_creation_input_tokens", 0),
+                ))
 
         elif msg_type == "system":
             subtype = msg.get("subtype", "")
@@ -188,51 +490,93 @@ def stream_agent_output(process):
             _log("[%s] %s" % (msg_type, json.dumps(msg)[:200]))
 
 
-def upload_file_to_sandbox(sb, local_path, remote_path):
-    """Upload a single file to the sandbox."""
-    content = Path(local_path).read_text()
-    with sb.open(remote_path, "w") as f:
-        f.write(content)
+@functools.lru_cache(maxsize=1)
+def _asset_bundle() -> bytes:
+    """Pack runner.py, treemux-report and skills into one tar.gz.
 
+    Built once per container and reused for every job it runs, so each
+    sandbox gets its assets in a single write plus one extract.
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        tar.add("/opt/treemux/runner.py", arcname="runner.py")
+        info = tar.gettarinfo(
+            "/opt/treemux/scripts/treemux_report.py",
+            arcname="usr/local/bin/treemux-report",
+        )
+        info.mode = 0o755
+        with open("/opt/treemux/scripts/treemux_report.py", "rb") as f:
+            tar.addfile(info, f)
+        skills_dir = Path("/opt/treemux/skills")
+        if skills_dir.exists():
+            tar.add(str(skills_dir), arcname="home/agent/.claude/skills")
+        else:
+            _log("No skills/ directory found, skipping")
+    return buf.getvalue()
 
-def upload_skills_to_sandbox(sb):
-    """Upload skills directory to sandbox."""
-    skills_dir = Path("/opt/treemux/skills")
-    if not skills_dir.exists():
-        _log("No skills/ directory found, skipping")
-        return
 
+def upload_assets_to_sandbox(sb):
+    """Upload runner.py, treemux-report and skills to the sandbox."""
+    bundle = _asset_bundle()
+    with sb.open("/tmp/treemux-assets.tar.gz", "wb") as f:
+        f.write(bundle)
     sb.exec(
-        "runuser", "-u", "agent", "--",
-        "mkdir", "-p", "/home/agent/.claude/skills",
+        "bash", "-c",
+        "tar -xzf /tmp/treemux-assets.tar.gz -C / --no-same-owner"
+        " && rm /tmp/treemux-assets.tar.gz"
+        " && mkdir -p /home/agent/.claude"
+        " && chown -R agent:agent /home/agent/.claude"
+        " && mkdir -p %s/blobs && chown agent:agent %s/blobs" % (_ARTIFACTS_DIR, _ARTIFACTS_DIR),
     ).wait()
+    _log("uploaded assets (%d bytes)" % len(bundle))
 
-    count = 0
-    for file_path in skills_dir.rglob("*"):
-        if not file_path.is_file():
-            continue
-        rel = file_path.relative_to(skills_dir)
-        remote = "/home/agent/.claude/skills/%s" % rel
-        remote_dir = str(Path(remote).parent)
-        sb.exec(
-            "runuser", "-u", "agent", "--",
-            "mkdir", "-p", remote_dir,
-        ).wait()
-        content = file_path.read_text()
-        with sb.open(remote, "w") as f:
-            f.write(content)
-        count += 1
 
-    sb.exec("bash", "-c", "chown -R agent:agent /home/agent/.claude").wait()
-    _log("Uploaded %d skill files" % count)
+def _create_sandbox():
+    """Create a job sandbox; job env is passed when the runner is exec'd."""
+    return modal.Sandbox.create(
+        app=app,
+        image=_sandbox_image,
+        volumes={_ARTIFACTS_DIR: _artifacts_volume},
+        workdir="/workspace",
+        timeout=_SANDBOX_TIMEOUT_S,
+    )
+
+
+def provision_sandbox(sb):
+    """Upload assets and initialise git in /workspace (no remote yet).
+
+    runner.py re-runs `git init` and adds the remote once the job's repo
+    and branch are known.
+    """
+    upload_assets_to_sandbox(sb)
+    sb.exec(
+        "runuser", "-u", "agent", "--", "bash", "-c",
+        "git init -q /workspace && git -C /workspace config core.untrackedCache true",
+    ).wait()
 
 
-def _post_callback(callback_base_url, path, body):
-    """Post a callback to the orchestrator (fallback when agent doesn't report)."""
+def _read_sandbox_json(sb, path) -> dict:
+    """Read a JSON file from the sandbox, or {} if missing or invalid."""
+    check = sb.exec("bash", "-c", "cat %s 2>/dev/null || echo '{}'" % path)
+    output = ""
+    for line in check.stdout:
+        output += line
+    check.wait()
+    try:
+        return json.loads(output)
+    except json.JSONDecodeError:
+        return {}
+
+
+def _post_callback(callback_base_url, path, body) -> bool:
+    """Post a callback to the orchestrator (fallback when agent doesn't report).
+
+    Returns False when the callback could not be delivered.
+    """
     import urllib.request
 
     if not callback_base_url:
-        return
+        return True
     url = callback_base_url.rstrip("/") + path
     try:
         req = urllib.request.Request(
@@ -242,15 +586,230 @@ def _post_callback(callback_base_url, path, body):
             method="POST",
         )
         urllib.request.urlopen(req, timeout=10)
+        return True
     except Exception as e:
         _log("callback %s error: %s" % (path, e))
+        return False
+
+
+# ── Job control ─────────────────────────────────────────────────
+# Progress snapshots and stop/extend signals are shared across function
+# calls through Modal Dicts keyed by (task_id, job_id).
+_progress_dict = modal.Dict.from_name("treemux-progress", create_if_missing=True)
+_control_dict = modal.Dict.from_name("treemux-control", create_if_missing=True)
+
+_AGENT_TIMEOUT_S = 1700  # hard cap on the runner exec
+_STOP_GRACE_S = 60  # left for the final commit/push/callback after a stop
+_CONTROL_POLL_S = 3
+
+# Tells runner.py why it was stopped; it then runs `treemux-report done --stopped`
+_STOP_FILE = "/tmp/.treemux-stop"
+
+# Control key job_id that applies to every job of a task
+_ALL_JOBS = "*"
+
+_SANDBOX_TIMEOUT_S = 7200
+
+# Sandboxes pre-provisioned by `prepare`, keyed by (task_id, sandbox_id).
+# A job claims one by popping its key, so each is handed out once.
+# Unclaimed ones are terminated after _RESERVATION_TTL_S, and the idle
+# sandbox time is accumulated under _RESERVATION_STATS.
+_reservations_dict = modal.Dict.from_name("treemux-reservations", create_if_missing=True)
+_RESERVATION_TTL_S = 900
+_RESERVATION_STATS = "_stats"
+_MAX_RESERVATIONS = 32
+
+
+def _control_for(key) -> dict:
+    """Merge task-wide and per-job control signals for (task_id, job_id)."""
+    control = dict(_control_dict.get((key[0], _ALL_JOBS)) or {})
+    control.update(_control_dict.get(key) or {})
+    return control
+
+
+class JobControl(threading.Thread):
+    """Publish a job's progress and act on stop/extend signals.
+
+    A stop writes the reason to _STOP_FILE and sends SIGTERM to runner.py,
+    which shuts the CLI down and lets treemux-report push and report.
+    The job is also stopped once its soft budget (plus any extension
+    granted by the pruning controller) runs out.
+    """
+
+    def __init__(self, sb, key, progress, budget_s, metrics=None):
+        super().__init__(daemon=True)
+        self.sb = sb
+        self.key = key
+        self.progress = progress
+        self.metrics = metrics
+        self.budget_s = budget_s
+        self.extend_s = 0
+        self.stopped = None
+        self._finished = threading.Event()
+
+    def run(self) -> None:
+        while not self._finished.wait(_CONTROL_POLL_S):
+            try:
+                self._publish(finished=False)
+                control = _control_for(self.key)
+            except Exception as e:
+                _log("job control error: %s" % e)
+                continue
+            max_extend = _AGENT_TIMEOUT_S - _STOP_GRACE_S - self.budget_s
+            self.extend_s = max(0, min(control.get("extend_s", 0), max_extend))
+            if control.get("stop"):
+                self.stop(control["stop"])
+            elif self.progress.snapshot()["elapsed_s"] > self.budget_s + self.extend_s:
+                self.stop("budget")
+
+    def _publish(self, finished: bool) -> None:
+        snapshot = self.progress.snapshot()
+        snapshot.update(
+            budget_s=self.budget_s,
+            extend_s=self.extend_s,
+            stopped=self.stopped,
+            finished=finished,
+            updated=time.time(),
+        )
+        if self.metrics is not None:
+            snapshot["metrics"] = self.metrics.snapshot()
+        _progress_dict[self.key] = snapshot
+
+    def stop(self, reason: str) -> None:
+        if self.stopped:
+            return
+        self.stopped = reason
+        _log("stopping agent gracefully: %s" % reason)
+        try:
+            self.sb.exec(
+                "bash", "-c",
+                "echo %s > %s && pkill -TERM -f '^python3 -u /runner.py'" % (reason, _STOP_FILE),
+            ).wait()
+        except Exception as e:
+            _log("stop signal error: %s" % e)
+
+    def finish(self) -> None:
+        self._finished.set()
+        if self.is_alive():
+            # A publish in flight must not land after the final one
+            self.join(timeout=_CONTROL_POLL_S + 30)
+        try:
+            self._publish(finished=True)
+        except Exception as e:
+            _log("job control error: %s" % e)
+
+
+def _score(snapshot: dict, weights: dict) -> float:
+    return (
+        weights["step_rate"] * snapshot.get("step_rate", 0)
+        - weights["build_errors"] * snapshot.get("build_errors", 0)
+        - weights["tool_error_ratio"] * snapshot.get("tool_error_ratio", 0)
+    )
+
+
+def plan_prune(snapshots: dict, policy: dict) -> dict:
+    """Decide which running workers of a task to stop.
+
+    snapshots maps job_id -> JobControl progress snapshot. Workers younger
+    than min_elapsed_s are never ranked. The bottom_k lowest-scoring
+    workers are stopped, but the min_keep best-ranked ones never are
+    (young unranked workers don't count toward it); with
+    mode="reallocate" their remaining budget is split across the top
+    survivors as an extension.
+    """
+    weights = {"step_rate": 1.0, "build_errors": 0.5, "tool_error_ratio": 2.0}
+    weights.update(policy.get("weights") or {})
+    min_elapsed = policy.get("min_elapsed_s", 300)
+    min_keep = max(1, policy.get("min_keep", 1))
+
+    running = {
+        job: snap for job, snap in snapshots.items()
+        if not snap.get("finished") and not snap.get("stopped")
+    }
+    ranked = sorted(
+        (job for job, snap in running.items() if snap.get("elapsed_s", 0) >= min_elapsed),
+        key=lambda job: _score(running[job], weights),
+    )
+    bottom_k = min(policy.get("bottom_k", 1), len(ranked) - min_keep)
+    stop = ranked[:max(0, bottom_k)]
+
+    extend, warnings = {}, []
+    if policy.get("bottom_k", 1) > len(stop):
+        warnings.append("stopping %d of bottom_k=%d: %d ranked, min_keep=%d" % (
+            len(stop), policy.get("bottom_k", 1), len(ranked), min_keep,
+        ))
+    if policy.get("mode") == "reallocate" and stop:
+        freed = sum(
+            max(0, running[job].get("budget_s", 0) + running[job].get("extend_s", 0) - running[job].get("elapsed_s", 0))
+            for job in stop
+        )
+        top = [job for job in reversed(ranked) if job not in stop][:policy.get("top_k", len(stop))]
+        if not top:
+            warnings.append("reallocate: no ranked survivor to receive %ds of freed budget" % freed)
+        for job in top:
+            extend[job] = running[job].get("extend_s", 0) + int(freed / len(top))
+
+    return {
+        "ranking": [{"jobId": job, "score": round(_score(running[job], weights), 3)} for job in ranked],
+        "stop": stop,
+        "extend": extend,
+        "warnings": warnings,
+    }
 
 
 # ── Sandbox runner ──────────────────────────────────────────────
+def _claim_reservation(task_id: str):
+    """Pop a live pre-provisioned sandbox for task_id.
+
+    Returns (sandbox, reservation) or (None, None) when none is left.
+    """
+    for key in list(_reservations_dict.keys()):
+        if not (isinstance(key, tuple) and key[0] == task_id):
+            continue
+        reservation = _reservations_dict.pop(key, None)
+        if reservation is None:
+            continue  # claimed by another job
+        try:
+            sb = modal.Sandbox.from_id(key[1])
+            if time.time() - reservation["created"] < _RESERVATION_TTL_S and sb.poll() is None:
+                return sb, reservation
+            sb.terminate()
+        except Exception as e:
+            _log("reservation %s unusable: %s" % (key[1], e))
+    return None, None
+
+
+@functools.lru_cache(maxsize=32)
+def _task_secret(
+    task_id, idea, callback_base_url, repo_url, github_token, vercel_token,
+    git_user_name, git_user_email, claude_oauth_token, anthropic_api_key,
+    openai_api_key, openrouter_api_key,
+):
+    """Task-wide sandbox env, shared by every job of the task in this container."""
+    return modal.Secret.from_dict({
+        "TASK_ID": task_id,
+        "IDEA": idea,
+        "CALLBACK_BASE_URL": callback_base_url,
+        "REPO_URL": repo_url,
+        "GITHUB_TOKEN": github_token,
+        "VERCEL_TOKEN": vercel_token,
+        "GIT_USER_NAME": git_user_name,
+        "GIT_USER_EMAIL": git_user_email,
+        "CLAUDE_CODE_OAUTH_TOKEN": claude_oauth_token,
+        "ANTHROPIC_API_KEY": anthropic_api_key,
+        "OPENAI_API_KEY": openai_api_key,
+        "OPENROUTER_API_KEY": openrouter_api_key,
+    })
+
+
+# Jobs mostly wait on their sandbox, so one container can drive several
+# and share the asset bundle and task secrets between them.
 @app.function(
     image=_fn_image,
     timeout=1900,
+    volumes={_TRACES_DIR: _traces_volume},
 )
+@modal.concurrent(max_inputs=8)
 def run_in_sandbox(
     task_id: str,
     job_id: str,
@@ -268,71 +827,120 @@ def run_in_sandbox(
     anthropic_api_key: str | None,
     openai_api_key: str | None,
     openrouter_api_key: str | None,
+    prompt_cache: bool = True,
+    budget_s: int | None = None,
+    stack: str | None = _DEFAULT_STACK,
+    fallback_models: list[str] | None = None,
+    max_attempts: int | None = None,
+    probe_routes: list[str] | None = None,
+    record_stream: bool = False,
 ) -> None:
-    """Create a Sandbox and run the agent."""
+    """Create a Sandbox and run the agent.
+
+    budget_s is a soft time limit after which the agent is stopped
+    gracefully (pushing and reporting what it has); it defaults to the
+    hard exec timeout minus the stop grace period. stack picks the project
+    template copied into /workspace (None or unknown scaffolds from scratch).
+    fallback_models are tried, after every credential, when the CLI keeps
+    failing with retryable provider errors, up to max_attempts CLI runs in
+    total (runner.py's default when None). probe_routes are the paths
+    `treemux-report step` requests from the verify server (only "/" when
+    None). record_stream saves the raw
+    agent stdout next to the tool trace for offline replay.
+    """
+    task_secret = _task_secret(
+        task_id, idea, callback_base_url or "", repo_url or "",
+        github_token or "", vercel_token or "",
+        git_user_name or "", git_user_email or "",
+        claude_oauth_token or "", anthropic_api_key or "",
+        openai_api_key or "", openrouter_api_key or "",
+    )
     job_secret = modal.Secret.from_dict({
-        "TASK_ID": task_id,
         "JOB_ID": job_id,
-        "IDEA": idea,
-        "CALLBACK_BASE_URL": callback_base_url or "",
         "BRANCH": branch,
-        "REPO_URL": repo_url or "",
-        "GITHUB_TOKEN": github_token or "",
-        "VERCEL_TOKEN": vercel_token or "",
-        "GIT_USER_NAME": git_user_name or "",
-        "GIT_USER_EMAIL": git_user_email or "",
-        "CLAUDE_CODE_OAUTH_TOKEN": claude_oauth_token or "",
-        "ANTHROPIC_API_KEY": anthropic_api_key or "",
-        "OPENAI_API_KEY": openai_api_key or "",
-        "OPENROUTER_API_KEY": openrouter_api_key or "",
+        "TREEMUX_ARTIFACT_STORE": "%s/blobs" % _ARTIFACTS_DIR,
+        "TREEMUX_ARTIFACT_URI_PREFIX": "modal-volume://treemux-artifacts/blobs/",
+        "TREEMUX_PROBE_ROUTES": ",".join(
+            [probe_routes] if isinstance(probe_routes, str) else probe_routes or []
+        ),
     })
 
-    _log("creating Sandbox task_id=%s job_id=%s branch=%s model=%s" % (task_id, job_id, branch, model or "default"))
+    if _control_for((task_id, job_id)).get("stop") == "cancelled":
+        _log("job %s cancelled before start" % job_id)
+        _post_callback(callback_base_url, "/v1.0/log/done", {
+            "taskId": task_id,
+            "jobId": job_id,
+            "repoUrl": repo_url or "",
+            "idea": idea,
+            "pitch": "Implementation was cancelled.",
+            "success": False,
+            "error": "Cancelled",
+            "branch": branch,
+            "stopped": "cancelled",
+        })
+        return
 
-    sb = modal.Sandbox.create(
-        app=app,
-        image=_sandbox_image,
-        secrets=[job_secret],
-        workdir="/workspace",
-        timeout=7200,
-    )
+    metrics = JobMetrics()
+    create_start = time.monotonic()
+    sb, reservation = _claim_reservation(task_id)
+    metrics.reserved = sb is not None
+    if sb is not None:
+        _log("claimed reserved Sandbox %s task_id=%s job_id=%s (provisioned in %.1fs, idle %.1fs)" % (
+            sb.object_id, task_id, job_id,
+            reservation["ready"] - reservation["created"], time.time() - reservation["ready"],
+        ))
+    else:
+        _log("creating Sandbox task_id=%s job_id=%s branch=%s model=%s" % (task_id, job_id, branch, model or "default"))
+        sb = _create_sandbox()
+    metrics.sandbox_create_s = round(time.monotonic() - create_start, 2)
 
     done_called = False
+    resources = {}
+    trace = ToolTrace()
+    progress = JobProgress()
+    recorder = None
+    control = JobControl(
+        sb, (task_id, job_id), progress,
+        min(budget_s or _AGENT_TIMEOUT_S, _AGENT_TIMEOUT_S) - _STOP_GRACE_S,
+        metrics=metrics,
+    )
     try:
-        # Upload runner.py
-        upload_file_to_sandbox(sb, "/opt/treemux/runner.py", "/runner.py")
-        _log("uploaded runner.py")
-
-        # Upload treemux-report tool
-        upload_file_to_sandbox(
-            sb, "/opt/treemux/scripts/treemux_report.py",
-            "/usr/local/bin/treemux-report",
-        )
-        sb.exec("chmod", "+x", "/usr/local/bin/treemux-report").wait()
-        _log("uploaded treemux-report")
+        # Lets `cancel` find and force-terminate the sandbox directly
+        sb.set_tags({"task_id": task_id, "job_id": job_id})
 
-        # Upload skills
-        upload_skills_to_sandbox(sb)
+        # Upload runner.py, treemux-report and skills
+        if reservation is None:
+            provision_sandbox(sb)
 
         # Build context JSON
         ctx = {
             "challenge_doc": idea,
             "worker_profile": worker_profile,
             "model": model,
+            "prompt_cache": prompt_cache,
+            "template": (
+                {"stack": stack, "hash": _template_hash(stack)}
+                if stack in _TEMPLATE_RECIPES else None
+            ),
+            "fallback_models": fallback_models or [],
+            "max_attempts": max_attempts,
         }
         ctx_json = json.dumps(ctx)
 
         _log("starting agent...")
 
+        metrics.exec_started = time.monotonic()
         p = sb.exec(
             "runuser", "-u", "agent", "--",
             "python3", "-u", "/runner.py", ctx_json,
-            timeout=1700,
+            secrets=[task_secret, job_secret],
+            timeout=_AGENT_TIMEOUT_S,
+            # Yield whole lines: the stream parser and recorder both need them
+            bufsize=1,
         )
+        control.start()
 
         # Stream stderr in background
-        import threading
-
         def _drain_stderr(proc):
             for line in proc.stderr:
                 _log("[stderr] %s" % line.strip())
@@ -342,45 +950,373 @@ def run_in_sandbox(
         )
         stderr_thread.start()
 
-        stream_agent_output(p)
+        if record_stream:
+            recorder = StreamRecorder(p)
+        stream_agent_output(recorder or p, trace=trace, progress=progress, metrics=metrics)
         exit_code = p.wait()
         stderr_thread.join(timeout=5)
 
         _log("agent exited with code %s" % exit_code)
 
         # Check if treemux-report done was called
-        check = sb.exec(
-            "bash", "-c",
-            "cat /tmp/.treemux-state.json 2>/dev/null || echo '{}'",
-        )
-        state_output = ""
-        for line in check.stdout:
-            state_output += line
-        check.wait()
-        try:
-            state = json.loads(state_output)
-            done_called = state.get("done", False)
-        except json.JSONDecodeError:
-            done_called = False
+        state = _read_sandbox_json(sb, "/tmp/.treemux-state.json")
+        done_called = state.get("done", False)
+        metrics.merge_sandbox(state.get("metrics") or {})
+        if not done_called:
+            resources = _read_sandbox_json(sb, "/tmp/.treemux-resources.json")
 
     finally:
         # Fallback: if agent never called treemux-report done, send failure
         if not done_called:
-            _log("agent did not call treemux-report done — sending failure callback")
-            _post_callback(callback_base_url, "/v1.0/log/done", {
-                "taskId": task_id,
-                "jobId": job_id,
-                "repoUrl": repo_url or "",
-                "idea": idea,
-                "pitch": "Implementation did not complete successfully.",
-                "success": False,
-                "error": "Agent exited without calling treemux-report done",
-                "branch": branch,
-            })
+            try:
+                cancelled = _control_for((task_id, job_id)).get("stop") == "cancelled"
+            except Exception:
+                cancelled = control.stopped == "cancelled"
+            if cancelled:
+                _log("job cancelled before treemux-report done — sending cancelled callback")
+                delivered = _post_callback(callback_base_url, "/v1.0/log/done", {
+                    "taskId": task_id,
+                    "jobId": job_id,
+                    "repoUrl": repo_url or "",
+                    "idea": idea,
+                    "pitch": "Implementation was cancelled.",
+                    "success": False,
+                    "error": "Cancelled",
+                    "branch": branch,
+                    "stopped": "cancelled",
+                })
+            else:
+                _log("agent did not call treemux-report done — sending failure callback")
+                delivered = _post_callback(callback_base_url, "/v1.0/log/done", {
+                    "taskId": task_id,
+                    "jobId": job_id,
+                    "repoUrl": repo_url or "",
+                    "idea": idea,
+                    "pitch": "Implementation did not complete successfully.",
+                    "success": False,
+                    "error": "Agent exited without calling treemux-report done",
+                    "branch": branch,
+                    "resources": resources or None,
+                })
+            metrics.callback_failures += 0 if delivered else 1
 
+        control.finish()
         sb.terminate()
         _log("Sandbox terminated")
 
+        try:
+            dest = "%s/%s/%s.jsonl.gz" % (_TRACES_DIR, task_id or "_", job_id or "_")
+            if trace.close(dest):
+                _traces_volume.commit()
+                _log("uploaded tool trace %s" % dest)
+        except Exception as e:
+            _log("tool trace upload error: %s" % e)
+
+        if recorder is not None:
+            try:
+                dest = "%s/%s/%s.stdout.gz" % (_TRACES_DIR, task_id or "_", job_id or "_")
+                lines = recorder.close(dest)
+                if lines:
+                    _traces_volume.commit()
+                    _log("uploaded stream recording %s (%d lines)" % (dest, lines))
+            except Exception as e:
+                _log("stream recording upload error: %s" % e)
+
+
+@app.function(image=_fn_image)
+def reserve_sandbox(task_id: str) -> None:
+    """Create and provision one sandbox and hold it for task_id."""
+    created = time.time()
+    sb = _create_sandbox()
+    sb.set_tags({"task_id": task_id, "reserved": "1"})
+    try:
+        provision_sandbox(sb)
+        _reservations_dict.put((task_id, sb.object_id), {
+            "created": created,
+            "ready": time.time(),
+        })
+    except Exception as e:
+        _log("reserve task_id=%s failed: %s" % (task_id, e))
+        sb.terminate()
+        return
+    _log("reserved Sandbox %s task_id=%s in %.1fs" % (sb.object_id, task_id, time.time() - created))
+
+
+@app.function(image=_fn_image, schedule=modal.Period(minutes=5))
+def expire_reservations() -> None:
+    """Terminate reserved sandboxes nobody claimed within the TTL.
+
+    The time they sat provisioned but unused is added to the wasted_s
+    total under _RESERVATION_STATS; this function is its only writer.
+    """
+    now = time.time()
+    stats = dict(_reservations_dict.get(_RESERVATION_STATS) or {"expired": 0, "wasted_s": 0.0})
+    for key, reservation in list(_reservations_dict.items()):
+        if not isinstance(key, tuple) or now - reservation["created"] < _RESERVATION_TTL_S:
+            continue
+        if _reservations_dict.pop(key, None) is None:
+            continue  # claimed meanwhile
+        try:
+            modal.Sandbox.from_id(key[1]).terminate()
+        except Exception as e:
+            _log("expire %s terminate error: %s" % (key[1], e))
+        wasted = now - reservation["created"]
+        stats["expired"] += 1
+        stats["wasted_s"] = round(stats["wasted_s"] + wasted, 1)
+        _log("expired reservation task_id=%s sandbox=%s wasted=%.0fs" % (key[0], key[1], wasted))
+    _reservations_dict.put(_RESERVATION_STATS, stats)
+
+
+# ── Fleet metrics ───────────────────────────────────────────────
+# Live jobs are read from their snapshots in _progress_dict. Once a job
+# finishes, fold_metrics moves its contribution into cumulative totals
+# and deletes the snapshot, so counters and histograms only ever grow
+# and _progress_dict only holds live jobs.
+_metrics_dict = modal.Dict.from_name("treemux-metrics", create_if_missing=True)
+_FLEET_TOTALS = "totals"
+_ACTIVE_STALE_S = 30  # a running job republishes every _CONTROL_POLL_S
+_FOLD_STALE_S = 3600  # an unfinished snapshot this old belongs to a dead job
+_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+_COUNTERS = ("jobs", "reserved_claims", "tool_calls", "callback_failures", "cost_usd")
+_HISTOGRAMS = ("sandbox_create_seconds", "first_token_seconds", "push_seconds")
+
+
+def _histogram(values, buckets=_LATENCY_BUCKETS) -> dict:
+    values = [v for v in values if v is not None]
+    return {
+        "count": len(values),
+        "sum": round(sum(values), 2),
+        "buckets": {str(b): sum(1 for v in values if v <= b) for b in buckets},
+    }
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _observations(snapshot: dict) -> dict:
+    """Histogram observations of one job snapshot."""
+    m = snapshot.get("metrics") or {}
+    return {
+        "sandbox_create_seconds": [m.get("sandbox_create_s")],
+        "first_token_seconds": [m.get("first_token_s")],
+        "push_seconds": list(m.get("push_s") or []),
+    }
+
+
+def _contribution(snapshot: dict) -> dict:
+    """Counter and histogram contributions of one job snapshot."""
+    m = snapshot.get("metrics") or {}
+    part = {
+        "jobs": 1,
+        "reserved_claims": 1 if m.get("reserved") else 0,
+        "tool_calls": snapshot.get("tool_calls", 0),
+        "callback_failures": m.get("callback_failures", 0),
+        "cost_usd": m.get("cost_usd", 0),
+    }
+    for name, values in _observations(snapshot).items():
+        part[name] = _histogram(values)
+    return part
+
+
+def _merge(total: dict, part: dict) -> dict:
+    for name in _COUNTERS:
+        total[name] = round(total.get(name, 0) + part.get(name, 0), 4)
+    for name in _HISTOGRAMS:
+        hist = total.setdefault(name, _histogram([]))
+        other = part.get(name) or _histogram([])
+        hist["count"] += other["count"]
+        hist["sum"] = round(hist["sum"] + other["sum"], 2)
+        for bound, count in other["buckets"].items():
+            hist["buckets"][bound] = hist["buckets"].get(bound, 0) + count
+    return total
+
+
+def aggregate_metrics(live, totals=None, reservations=None, now=None) -> dict:
+    """Fleet metrics from folded totals plus live job snapshots.
+
+    Counters and histograms are cumulative. p50/p95 are over the live
+    snapshots only and are exposed as gauges.
+    """
+    now = now or time.time()
+    active = [
+        snap for snap in live
+        if not snap.get("finished") and now - snap.get("updated", 0) < _ACTIVE_STALE_S
+    ]
+    fleet = _merge({}, totals or {})
+    for snap in live:
+        _merge(fleet, _contribution(snap))
+    fleet.update(
+        active_sandboxes=len(active),
+        # Current fleet rate: each active job's calls over its elapsed time
+        tool_calls_per_minute=round(sum(
+            snap.get("tool_calls", 0) * 60 / max(snap.get("elapsed_s", 0), 60)
+            for snap in active
+        ), 1),
+        reservations_expired=(reservations or {}).get("expired", 0),
+        reservations_wasted_seconds=(reservations or {}).get("wasted_s", 0.0),
+    )
+    for name in _HISTOGRAMS:
+        values = [v for snap in live for v in _observations(snap)[name] if v is not None]
+        fleet[name]["p50"] = _percentile(values, 50)
+        fleet[name]["p95"] = _percentile(values, 95)
+    return fleet
+
+
+def _prometheus(fleet: dict) -> str:
+    """Render aggregate_metrics output in the Prometheus text format."""
+    lines = []
+    counters = {
+        "jobs": "Jobs started",
+        "reserved_claims": "Jobs that started on a pre-provisioned sandbox",
+        "tool_calls": "Tool calls",
+        "callback_failures": "Undelivered orchestrator callbacks",
+        "cost_usd": "Agent cost in USD",
+        "reservations_expired": "Pre-provisioned sandboxes expired unclaimed",
+        "reservations_wasted_seconds": "Sandbox time spent on expired reservations",
+    }
+    for name, help_text in counters.items():
+        lines += [
+            "# HELP treemux_%s_total %s" % (name, help_text),
+            "# TYPE treemux_%s_total counter" % name,
+            "treemux_%s_total %s" % (name, fleet[name]),
+        ]
+    gauges = {
+        "active_sandboxes": "Jobs with a running sandbox",
+        "tool_calls_per_minute": "Current tool calls per minute across active jobs",
+    }
+    for name, help_text in gauges.items():
+        lines += [
+            "# HELP treemux_%s %s" % (name, help_text),
+            "# TYPE treemux_%s gauge" % name,
+            "treemux_%s %s" % (name, fleet[name]),
+        ]
+    histograms = {
+        "sandbox_create_seconds": "Sandbox create (or claim) latency",
+        "first_token_seconds": "Runner start to first assistant message",
+        "push_seconds": "git push latency in treemux-report",
+    }
+    for name, help_text in histograms.items():
+        hist = fleet[name]
+        lines += [
+            "# HELP treemux_%s %s" % (name, help_text),
+            "# TYPE treemux_%s histogram" % name,
+        ]
+        for bound in _LATENCY_BUCKETS:
+            lines.append('treemux_%s_bucket{le="%s"} %d' % (name, bound, hist["buckets"].get(str(bound), 0)))
+        lines += [
+            'treemux_%s_bucket{le="+Inf"} %d' % (name, hist["count"]),
+            "treemux_%s_sum %s" % (name, hist["sum"]),
+            "treemux_%s_count %d" % (name, hist["count"]),
+        ]
+        for pct in ("p50", "p95"):
+            if hist.get(pct) is not None:
+                lines += [
+                    "# HELP treemux_%s_live_%s %s, %s over live jobs" % (name, pct, help_text, pct),
+                    "# TYPE treemux_%s_live_%s gauge" % (name, pct),
+                    "treemux_%s_live_%s %s" % (name, pct, hist[pct]),
+                ]
+    return "\n".join(lines) + "\n"
+
+
+@app.function(image=_fn_image, schedule=modal.Period(minutes=1))
+def fold_metrics() -> None:
+    """Fold finished (or long-dead) jobs into the cumulative fleet totals.
+
+    This is the only writer of _FLEET_TOTALS. Totals are written before the
+    snapshots are deleted, and list the keys just folded so a concurrent
+    scrape that still saw those snapshots doesn't count them twice.
+    """
+    now = time.time()
+    totals = dict(_metrics_dict.get(_FLEET_TOTALS) or {})
+    folded = []
+    for key, snapshot in list(_progress_dict.items()):
+        if not isinstance(key, tuple):
+            continue
+        if snapshot.get("finished") or now - snapshot.get("updated", 0) > _FOLD_STALE_S:
+            _merge(totals, _contribution(snapshot))
+            folded.append(key)
+    totals["folded"] = folded
+    _metrics_dict.put(_FLEET_TOTALS, totals)
+    for key in folded:
+        _progress_dict.pop(key, None)
+    if folded:
+        _log("folded metrics of %d finished jobs" % len(folded))
+
+
+@app.function(image=_fn_image)
+@modal.fastapi_endpoint(method="GET")
+async def metrics(request: Request):
+    """Fleet metrics across all jobs, in Prometheus text or JSON.
+
+    Query: format=prometheus|json.
+    """
+    now = time.time()
+    live = {}
+    async for key, snapshot in _progress_dict.items.aio():
+        if isinstance(key, tuple):
+            live[key] = snapshot
+    # Read after the snapshots: keys folded in between are listed here
+    totals = await _metrics_dict.get.aio(_FLEET_TOTALS) or {}
+    for key in totals.get("folded") or []:
+        live.pop(tuple(key), None)
+    reservations = await _reservations_dict.get.aio(_RESERVATION_STATS)
+    fleet = aggregate_metrics(list(live.values()), totals, reservations, now)
+
+    if request.query_params.get("format") == "json":
+        return {"ok": True, **fleet}
+    return Response(
+        content=_prometheus(fleet),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+# ── HTTP prepare ────────────────────────────────────────────────
+@app.function(image=_fn_image)
+@modal.fastapi_endpoint(method="POST")
+async def prepare(request: Request):
+    """Pre-provision sandboxes for a task before its jobs are known.
+
+    Body: task_id and count. Sandboxes are created, get their assets and
+    an empty git repo, and are held for the task; each job of the task
+    started later by `trigger` or `trigger_task` claims one instead of
+    creating its own. Reservations left unclaimed expire after
+    _RESERVATION_TTL_S.
+    """
+    raw = await request.body()
+    try:
+        body = json.loads(raw)
+    except json.JSONDecodeError as e:
+        _log("prepare invalid JSON: %s" % e)
+        return Response(
+            content=json.dumps({"ok": False, "error": "Invalid JSON"}),
+            status_code=400,
+            media_type="application/json",
+        )
+    task_id = body.get("task_id") or ""
+    count = body.get("count")
+    if not task_id:
+        return Response(
+            content=json.dumps({"ok": False, "error": "task_id is required"}),
+            status_code=400,
+            media_type="application/json",
+        )
+    if not isinstance(count, int) or not 0 < count <= _MAX_RESERVATIONS:
+        return Response(
+            content=json.dumps({
+                "ok": False, "error": "count must be an integer from 1 to %d" % _MAX_RESERVATIONS,
+            }),
+            status_code=400,
+            media_type="application/json",
+        )
+
+    await asyncio.gather(*(reserve_sandbox.spawn.aio(task_id) for _ in range(count)))
+    _log("prepare task_id=%s reserving %d sandboxes" % (task_id, count))
+    return {"ok": True, "taskId": task_id, "reserving": count, "ttlSeconds": _RESERVATION_TTL_S}
+
 
 # ── HTTP trigger ────────────────────────────────────────────────
 @app.function(image=_fn_image)
@@ -397,22 +1333,168 @@ async def trigger(request: Request):
             status_code=400,
             media_type="application/json",
         )
-    run_in_sandbox.spawn(
-        task_id=body.get("task_id") or "",
-        job_id=body.get("job_id") or "",
-        idea=body.get("idea") or "",
-        worker_profile=body.get("worker_profile") or "",
-        callback_base_url=body.get("callback_base_url") or "",
-        branch=body.get("branch") or "main",
-        repo_url=body.get("repo_url"),
-        github_token=body.get("github_token"),
-        vercel_token=body.get("vercel_token"),
-        git_user_name=body.get("git_user_name"),
-        git_user_email=body.get("git_user_email"),
-        claude_oauth_token=body.get("claude_oauth_token"),
-        model=body.get("model"),
-        anthropic_api_key=body.get("anthropic_api_key"),
-        openai_api_key=body.get("openai_api_key"),
-        openrouter_api_key=body.get("openrouter_api_key"),
-    )
+    run_in_sandbox.spawn(**_job_kwargs(body, body))
     return {"ok": True, "message": "implementation spawned"}
+
+
+def _job_kwargs(shared: dict, worker: dict) -> dict:
+    """run_in_sandbox kwargs from task-wide fields plus one worker's fields."""
+    return dict(
+        task_id=shared.get("task_id") or "",
+        job_id=worker.get("job_id") or "",
+        idea=shared.get("idea") or "",
+        worker_profile=worker.get("worker_profile") or "",
+        callback_base_url=shared.get("callback_base_url") or "",
+        branch=worker.get("branch") or "main",
+        repo_url=shared.get("repo_url"),
+        github_token=shared.get("github_token"),
+        vercel_token=shared.get("vercel_token"),
+        git_user_name=shared.get("git_user_name"),
+        git_user_email=shared.get("git_user_email"),
+        claude_oauth_token=shared.get("claude_oauth_token"),
+        model=worker.get("model") or shared.get("model"),
+        anthropic_api_key=shared.get("anthropic_api_key"),
+        openai_api_key=shared.get("openai_api_key"),
+        openrouter_api_key=shared.get("openrouter_api_key"),
+        prompt_cache=shared.get("prompt_cache", True) is not False,
+        budget_s=shared.get("budget_s"),
+        stack=shared.get("stack", _DEFAULT_STACK),
+        fallback_models=shared.get("fallback_models"),
+        max_attempts=shared.get("max_attempts"),
+        probe_routes=worker.get("probe_routes") or shared.get("probe_routes"),
+        record_stream=bool(worker.get("record_stream", shared.get("record_stream", False))),
+    )
+
+
+# ── HTTP task trigger ───────────────────────────────────────────
+@app.function(image=_fn_image)
+@modal.fastapi_endpoint(method="POST")
+async def trigger_task(request: Request):
+    """Start every worker of a task in one request.
+
+    Body: the task-wide fields accepted by `trigger` (task_id, idea,
+    repo_url, tokens, callback_base_url, ...) once, plus `workers`, a
+    list of {job_id, worker_profile, branch, model}. All jobs are
+    spawned concurrently.
+    """
+    raw = await request.body()
+    _log("trigger_task received body length=%s" % len(raw))
+    try:
+        body = json.loads(raw)
+    except json.JSONDecodeError as e:
+        _log("trigger_task invalid JSON: %s" % e)
+        return Response(
+            content=json.dumps({"ok": False, "error": "Invalid JSON"}),
+            status_code=400,
+            media_type="application/json",
+        )
+    workers = body.get("workers")
+    if not isinstance(workers, list) or not workers:
+        return Response(
+            content=json.dumps({"ok": False, "error": "workers must be a non-empty list"}),
+            status_code=400,
+            media_type="application/json",
+        )
+
+    await asyncio.gather(*(
+        run_in_sandbox.spawn.aio(**_job_kwargs(body, worker)) for worker in workers
+    ))
+    _log("trigger_task task_id=%s spawned %d jobs" % (body.get("task_id"), len(workers)))
+    return {
+        "ok": True,
+        "message": "%d implementations spawned" % len(workers),
+        "jobIds": [worker.get("job_id") for worker in workers],
+    }
+
+
+# ── HTTP cancel ─────────────────────────────────────────────────
+@app.function(image=_fn_image)
+@modal.fastapi_endpoint(method="POST")
+async def cancel(request: Request):
+    """Cancel one job (task_id + job_id) or every job of a task (task_id).
+
+    Running jobs pick the signal up within a few seconds: the CLI gets
+    SIGTERM, treemux-report pushes a final commit and posts a cancelled
+    done callback, and the sandbox is terminated. Jobs that have not
+    started yet exit before creating a sandbox. With force=true the
+    matching sandboxes are terminated immediately, skipping the flush.
+    """
+    raw = await request.body()
+    try:
+        body = json.loads(raw)
+    except json.JSONDecodeError as e:
+        _log("cancel invalid JSON: %s" % e)
+        return Response(
+            content=json.dumps({"ok": False, "error": "Invalid JSON"}),
+            status_code=400,
+            media_type="application/json",
+        )
+    task_id = body.get("task_id") or ""
+    job_id = body.get("job_id") or ""
+    if not task_id:
+        return Response(
+            content=json.dumps({"ok": False, "error": "task_id is required"}),
+            status_code=400,
+            media_type="application/json",
+        )
+
+    await _control_dict.put.aio((task_id, job_id or _ALL_JOBS), {"stop": "cancelled"})
+
+    terminated = 0
+    if body.get("force"):
+        tags = {"task_id": task_id}
+        if job_id:
+            tags["job_id"] = job_id
+        async for sb in modal.Sandbox.list.aio(app_id=app.app_id, tags=tags):
+            await sb.terminate.aio()
+            terminated += 1
+
+    _log("cancel task_id=%s job_id=%s force=%s terminated=%d" % (
+        task_id, job_id or _ALL_JOBS, bool(body.get("force")), terminated,
+    ))
+    return {"ok": True, "taskId": task_id, "jobId": job_id or None, "terminated": terminated}
+
+
+# ── HTTP prune ──────────────────────────────────────────────────
+@app.function(image=_fn_image)
+@modal.fastapi_endpoint(method="POST")
+async def prune(request: Request):
+    """Stop the weakest running workers of a task early.
+
+    Body: task_id plus the plan_prune policy (bottom_k, mode, top_k,
+    min_elapsed_s, min_keep, weights). Set dry_run to only get the plan.
+    Stopped workers still commit, push and send their done callback.
+    """
+    raw = await request.body()
+    try:
+        body = json.loads(raw)
+    except json.JSONDecodeError as e:
+        _log("prune invalid JSON: %s" % e)
+        return Response(
+            content=json.dumps({"ok": False, "error": "Invalid JSON"}),
+            status_code=400,
+            media_type="application/json",
+        )
+    task_id = body.get("task_id") or ""
+    if not task_id:
+        return Response(
+            content=json.dumps({"ok": False, "error": "task_id is required"}),
+            status_code=400,
+            media_type="application/json",
+        )
+
+    snapshots = {}
+    async for key, snapshot in _progress_dict.items.aio():
+        if isinstance(key, tuple) and key[0] == task_id:
+            snapshots[key[1]] = snapshot
+    plan = plan_prune(snapshots, body)
+    _log("prune task_id=%s stop=%s extend=%s dry_run=%s warnings=%s" % (
+        task_id, plan["stop"], plan["extend"], bool(body.get("dry_run")), plan["warnings"],
+    ))
+
+    if not body.get("dry_run"):
+        for job_id in plan["stop"]:
+            await _control_dict.put.aio((task_id, job_id), {"stop": "pruned"})
+        for job_id, extend_s in plan["extend"].items():
+            await _control_dict.put.aio((task_id, job_id), {"extend_s": extend_s})
+    return {"ok": True, **plan}
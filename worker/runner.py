@@ -4,18 +4,91 @@
 Sets up the environment, configures git, builds the system prompt
 with treemux-report documentation, and invokes the Claude Code CLI.
 """
+import collections
+import hashlib
 import json
 import os
+import random
+import re
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import urllib.request
+
+STATE_FILE = "/tmp/.treemux-state.json"
+# Written by the worker before it sends SIGTERM; holds the stop reason
+STOP_FILE = "/tmp/.treemux-stop"
+STOP_FLUSH_TIMEOUT_S = 50
+
+# Resource sampler: summary is read by `treemux-report done` and the worker
+RESOURCES_FILE = "/tmp/.treemux-resources.json"
+SAMPLE_INTERVAL_S = 5
+SAMPLE_CAPACITY = 2048  # ring buffer, ~2.8h at 5s
+DISK_SAMPLE_EVERY = 6  # `du` is the expensive probe; run it every 30s
+SUMMARY_EVERY = 6
+SUMMARY_POINTS = 100
+
+# Provider routing: retryable CLI failures are relaunched (resuming the
+# session) on the next credential/model with exponential backoff
+RETRYABLE_ERROR = re.compile(
+    r"rate.?limit|overloaded|too many requests|\b(429|500|502|503|529)\b"
+    r"|api_error|ECONNRESET|ETIMEDOUT|socket hang up",
+    re.IGNORECASE,
+)
+MAX_ATTEMPTS = 4
+BACKOFF_BASE_S = 10
+BACKOFF_MAX_S = 120
+# Every var that selects how the CLI authenticates; cleared per credential
+CREDENTIAL_VARS = (
+    "CLAUDE_CODE_OAUTH_TOKEN", "ANTHROPIC_API_KEY",
+    "ANTHROPIC_AUTH_TOKEN", "ANTHROPIC_BASE_URL",
+)
+OPENROUTER_BASE_URL = "https://openrouter.ai/api"
+RESUME_PROMPT = (
+    "The previous run was interrupted by a provider error. "
+    "Continue from where you left off."
+)
+
+# Pre-scaffolded projects baked into the sandbox image, one per stack, with
+# a <stack>.json manifest (recipe hash, scaffold duration) next to each.
+TEMPLATES_DIR = "/opt/templates"
+TEMPLATE_DESCRIPTIONS = {
+    "nextjs-shadcn": (
+        "Next.js (App Router, TypeScript, Tailwind, `src/` dir, `@/*` alias) "
+        "+ shadcn/ui with button, card and input components"
+    ),
+    "vite-react": "Vite + React + TypeScript",
+}
+
+SCAFFOLD_COMMANDS = """- Default to **Next.js + shadcn/ui** stack (or Vite + React if more appropriate)
+- **CRITICAL: All setup commands MUST be fully non-interactive (no TTY available).** Use these exact commands:
+  1. Create Next.js app: `bunx create-next-app@latest . --yes --typescript --tailwind --eslint --app --src-dir --no-react-compiler --import-alias "@/*" --turbopack --use-bun`
+  2. Init shadcn/ui: `bunx shadcn@latest init -d -y --force`
+  3. Add components: `bunx shadcn@latest add button card input -y --overwrite`"""
 
+SCAFFOLD_READY = """- **A %s project is already scaffolded in /workspace with dependencies installed.** Build on it directly.
+- Do NOT run `create-next-app`, `create-vite` or `shadcn init` — they would overwrite the scaffold.
+- **CRITICAL: All commands MUST be fully non-interactive (no TTY available).**"""
 
-def build_system_prompt(worker_profile):
-    """Build system prompt with treemux-report tool docs and best practices."""
-    profile_section = ""
-    if worker_profile:
-        profile_section = "\n\n## Your Profile\n\n%s\n" % worker_profile
+
+def build_system_prompt(challenge_doc, template_stack=None):
+    """Build system prompt with treemux-report tool docs and best practices.
+
+    Only task-wide content goes here (shared instructions, then the
+    challenge), so every worker of a task sends a byte-identical prefix
+    that the API can serve from the prompt cache. Per-worker content
+    belongs in build_user_prompt. When template_stack is set, the agent
+    is told the scaffold already exists instead of how to create it.
+    """
+    if template_stack:
+        scaffold = SCAFFOLD_READY % TEMPLATE_DESCRIPTIONS.get(template_stack, template_stack)
+        if template_stack == "nextjs-shadcn":
+            scaffold += "\n- Add more components with: `bunx shadcn@latest add <component> -y --overwrite`"
+    else:
+        scaffold = SCAFFOLD_COMMANDS
 
     return """## treemux-report Tool
 
@@ -41,6 +114,8 @@ treemux-report done
 ### Important Rules
 - Call `treemux-report start` EARLY, right after you decide what to build and have a plan.
 - Call `treemux-report step`. Each call commits & pushes your code.
+  - It also builds and serves the app locally; if the build fails it prints the errors and skips the deploy, so fix them before the next step.
+  - It requests `/` from that server by default; once you have more pages or API routes, export `TREEMUX_PROBE_ROUTES` (comma-separated paths, e.g. `TREEMUX_PROBE_ROUTES=/,/api/health treemux-report step ...`) so they are checked too.
   - Your FIRST `treemux-report step` should be right some initial boilerplate setup.
   - Try to keep your number of steps in 2~4 range.
 - Write a compelling pitch to `/workspace/PITCH.md` BEFORE calling `treemux-report done`.
@@ -51,14 +126,10 @@ treemux-report done
 
 ### Web Projects
 - Use `bun` as the package manager and runtime
-- Default to **Next.js + shadcn/ui** stack (or Vite + React if more appropriate)
-- **CRITICAL: All setup commands MUST be fully non-interactive (no TTY available).** Use these exact commands:
-  1. Create Next.js app: `bunx create-next-app@latest . --yes --typescript --tailwind --eslint --app --src-dir --no-react-compiler --import-alias "@/*" --turbopack --use-bun`
-  2. Init shadcn/ui: `bunx shadcn@latest init -d -y --force`
-  3. Add components: `bunx shadcn@latest add button card input -y --overwrite`
+%s
 - Install packages with `bun add <package>`
 - NEVER run interactive commands. Always pass `--yes`, `-y`, `-d`, etc. to skip all prompts.
-- **IMPORTANT: After creating a Next.js app, add this to `next.config.ts` to allow iframe embedding:**
+- **IMPORTANT: For a Next.js app, add this to `next.config.ts` to allow iframe embedding:**
   ```typescript
   const nextConfig = {
     async headers() {
@@ -96,7 +167,438 @@ treemux-report done
 
 ## Working Directory
 
-All code MUST be written in /workspace.%s""" % profile_section
+All code MUST be written in /workspace.
+
+## Challenge
+
+%s
+""" % (scaffold, challenge_doc)
+
+
+def build_user_prompt(worker_profile):
+    """Build the per-worker prompt, sent after the shared cached prefix."""
+    profile_section = ""
+    if worker_profile:
+        profile_section = "## Your Profile\n\n%s\n\n" % worker_profile
+    return (
+        profile_section
+        + "Start thinking about what to build then build it. You have full autonomy to execute."
+    )
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _du_mb(path):
+    if not os.path.exists(path):
+        return 0.0
+    try:
+        out = subprocess.run(
+            ["du", "-sk", path], capture_output=True, text=True, timeout=30,
+        ).stdout
+        return round(int(out.split()[0]) / 1024, 1)
+    except (OSError, ValueError, IndexError, subprocess.TimeoutExpired):
+        return 0.0
+
+
+class ResourceSampler(threading.Thread):
+    """Sample sandbox CPU, memory, disk, fds and processes from /proc.
+
+    Samples go into a fixed-size ring buffer; a compact summary (peaks,
+    p95 and a series downsampled to SUMMARY_POINTS) is written to
+    RESOURCES_FILE periodically and on stop.
+    """
+
+    METRICS = ("cpu_cores", "rss_mb", "workspace_mb", "node_modules_mb", "fds", "procs")
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = collections.deque(maxlen=SAMPLE_CAPACITY)
+        # Samples taken so far; unlike len(samples) it keeps growing once
+        # the ring buffer is full
+        self.ticks = 0
+        self.started = time.time()
+        self.peak_procs = []
+        self._peak_rss = 0
+        self._cpu = None
+        self._disk = (0.0, 0.0)
+        self._stopped = threading.Event()
+
+    def _cpu_cores(self):
+        """CPU in use since the last sample, in cores."""
+        with open("/proc/stat") as f:
+            fields = [int(x) for x in f.readline().split()[1:]]
+        idle, total = fields[3] + fields[4], sum(fields)
+        prev, self._cpu = self._cpu, (idle, total)
+        if prev is None or total == prev[1]:
+            return 0.0
+        busy = 1 - (idle - prev[0]) / (total - prev[1])
+        return round(busy * (os.cpu_count() or 1), 2)
+
+    def _processes(self):
+        """Return (total rss MB, open fds, [(rss MB, name)]) over all pids."""
+        rss_kb, fds, procs = 0, 0, []
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            try:
+                with open("/proc/%s/status" % pid) as f:
+                    status = dict(
+                        line.split(":", 1) for line in f if ":" in line
+                    )
+                kb = int(status.get("VmRSS", "0 kB").split()[0])
+                rss_kb += kb
+                procs.append((round(kb / 1024, 1), status.get("Name", "?").strip()))
+                fds += len(os.listdir("/proc/%s/fd" % pid))
+            except (OSError, ValueError):
+                continue
+        return round(rss_kb / 1024, 1), fds, procs
+
+    def sample(self):
+        rss_mb, fds, procs = self._processes()
+        if self.ticks % DISK_SAMPLE_EVERY == 0:
+            self._disk = (_du_mb("/workspace"), _du_mb("/workspace/node_modules"))
+        if rss_mb > self._peak_rss:
+            # Keep the process tree as it looked at peak memory
+            self._peak_rss = rss_mb
+            self.peak_procs = sorted(procs, reverse=True)[:5]
+        self.samples.append({
+            "t": round(time.time() - self.started),
+            "cpu_cores": self._cpu_cores(),
+            "rss_mb": rss_mb,
+            "workspace_mb": self._disk[0],
+            "node_modules_mb": self._disk[1],
+            "fds": fds,
+            "procs": len(procs),
+        })
+        self.ticks += 1
+
+    def summary(self):
+        samples = list(self.samples)
+        if not samples:
+            return {}
+        # Downsample by bucket max so short spikes survive
+        size = max(1, -(-len(samples) // SUMMARY_POINTS))
+        buckets = [samples[i:i + size] for i in range(0, len(samples), size)]
+        return {
+            "samples": len(samples),
+            "intervalSeconds": SAMPLE_INTERVAL_S,
+            "peak": {m: max(s[m] for s in samples) for m in self.METRICS},
+            "p95": {m: _percentile([s[m] for s in samples], 95) for m in self.METRICS},
+            "peakProcesses": [{"name": n, "rss_mb": r} for r, n in self.peak_procs],
+            "series": {
+                "t": [b[0]["t"] for b in buckets],
+                **{m: [max(s[m] for s in b) for b in buckets] for m in self.METRICS},
+            },
+        }
+
+    def write_summary(self):
+        tmp = RESOURCES_FILE + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.summary(), f)
+        os.replace(tmp, RESOURCES_FILE)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+                if self.ticks % SUMMARY_EVERY == 0:
+                    self.write_summary()
+            except Exception as e:
+                print("Resource sampler error: %s" % e, file=sys.stderr)
+            self._stopped.wait(SAMPLE_INTERVAL_S)
+
+    def stop(self):
+        self._stopped.set()
+        self.join(timeout=SAMPLE_INTERVAL_S + 30)
+        try:
+            self.write_summary()
+        except OSError as e:
+            print("Resource summary write failed: %s" % e, file=sys.stderr)
+
+
+def template_content_hash(path):
+    """Hash of package.json plus the bun lockfile, as written at build time."""
+    digest = hashlib.sha256()
+    for name in ("package.json", "bun.lock", "bun.lockb"):
+        try:
+            with open(os.path.join(path, name), "rb") as f:
+                digest.update(f.read())
+        except FileNotFoundError:
+            if name == "package.json":
+                return None
+    return digest.hexdigest()[:16]
+
+
+def prepare_template(template):
+    """Copy the pre-built project template for a stack into /workspace.
+
+    template is {"stack", "hash"} from the worker; the snapshot is only used
+    when its manifest hash matches, i.e. it was built from the current
+    recipe, and its package.json and lockfile are the ones the build
+    recorded. Records the time saved in the treemux state file and returns
+    the report, or None when no fresh snapshot is available.
+    """
+    if not template or not template.get("stack"):
+        return None
+    stack = template["stack"]
+    try:
+        with open(os.path.join(TEMPLATES_DIR, "%s.json" % stack)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        print("Template %s not available, scaffolding from scratch" % stack, file=sys.stderr)
+        return None
+    if manifest.get("hash") != template.get("hash"):
+        print(
+            "Template %s is stale (hash %s, expected %s), scaffolding from scratch"
+            % (stack, manifest.get("hash"), template.get("hash")),
+            file=sys.stderr,
+        )
+        return None
+    content_hash = template_content_hash(os.path.join(TEMPLATES_DIR, stack))
+    if manifest.get("content_hash") != content_hash:
+        print(
+            "Template %s does not match its manifest (content %s, recorded %s), "
+            "scaffolding from scratch" % (stack, content_hash, manifest.get("content_hash")),
+            file=sys.stderr,
+        )
+        return None
+
+    start = time.monotonic()
+    try:
+        subprocess.run(
+            ["cp", "-a", os.path.join(TEMPLATES_DIR, stack) + "/.", "/workspace/"],
+            check=True, capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        stderr = (e.stderr or b"").decode(errors="replace").strip()
+        print("Template copy failed: %s stderr=%s" % (e, stderr), file=sys.stderr)
+        return None
+    copy_s = time.monotonic() - start
+
+    report = {
+        "stack": stack,
+        "hash": manifest["hash"],
+        "contentHash": content_hash,
+        "copySeconds": round(copy_s, 1),
+        "scaffoldSeconds": manifest.get("scaffold_s"),
+        "savedSeconds": round(max(0, (manifest.get("scaffold_s") or 0) - copy_s), 1),
+    }
+    update_state(template=report)
+    print(
+        "Template %s copied in %.1fs (saved ~%ss of scaffolding)"
+        % (stack, copy_s, report["savedSeconds"]),
+        file=sys.stderr,
+    )
+    return report
+
+
+def update_state(**fields):
+    """Merge fields into the treemux-report state file."""
+    state = {}
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+    state.update(fields)
+    with open(STATE_FILE, "w") as f:
+        json.dump(state, f)
+
+
+def post_callback(path, body):
+    """POST a callback to the orchestrator; failures are only logged."""
+    base = os.environ.get("CALLBACK_BASE_URL", "").strip()
+    if not base:
+        return
+    try:
+        req = urllib.request.Request(
+            base.rstrip("/") + path,
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        urllib.request.urlopen(req, timeout=15)
+    except Exception as e:
+        print("callback %s error: %s" % (path, e), file=sys.stderr)
+
+
+def provider_credentials(env):
+    """Configured credentials the Claude CLI can use, as (name, env) pairs.
+
+    OPENAI_API_KEY is not listed: the Claude CLI cannot run on it.
+    """
+    credentials = []
+    if env.get("CLAUDE_CODE_OAUTH_TOKEN"):
+        credentials.append(("claude-oauth", {
+            "CLAUDE_CODE_OAUTH_TOKEN": env["CLAUDE_CODE_OAUTH_TOKEN"],
+        }))
+    if env.get("ANTHROPIC_API_KEY"):
+        credentials.append(("anthropic", {
+            "ANTHROPIC_API_KEY": env["ANTHROPIC_API_KEY"],
+        }))
+    if env.get("OPENROUTER_API_KEY"):
+        credentials.append(("openrouter", {
+            "ANTHROPIC_BASE_URL": OPENROUTER_BASE_URL,
+            "ANTHROPIC_AUTH_TOKEN": env["OPENROUTER_API_KEY"],
+        }))
+    return credentials
+
+
+class ProviderRouter:
+    """Choose the credential and model for each CLI launch.
+
+    Workers start on an Anthropic credential picked by hashing their job
+    id, which spreads a task's workers across keys; OpenRouter is only
+    used for failover. Each failover moves to the next credential; once
+    all have been tried, it also moves to the next fallback model.
+    """
+
+    def __init__(self, env, job_id, model, fallback_models, max_attempts):
+        credentials = provider_credentials(env)
+        primary = [c for c in credentials if c[0] != "openrouter"]
+        secondary = [c for c in credentials if c[0] == "openrouter"]
+        offset = int(hashlib.sha1(job_id.encode()).hexdigest(), 16) % max(len(primary), 1)
+        self.credentials = (
+            primary[offset:] + primary[:offset] + secondary
+        ) or [("default", {})]
+        self.models = [model] + [m for m in fallback_models if m != model]
+        self.max_attempts = max_attempts
+        self.attempt = 0
+        self.failovers = []
+        self.time_lost_s = 0.0
+
+    def current(self):
+        """Return (credential name, model) for the current attempt."""
+        n = len(self.credentials)
+        model = self.models[min(self.attempt // n, len(self.models) - 1)]
+        return self.credentials[self.attempt % n][0], model
+
+    def env(self, base):
+        """base with only the current credential's auth vars set."""
+        overlay = self.credentials[self.attempt % len(self.credentials)][1]
+        if not overlay:
+            return dict(base)
+        env = {k: v for k, v in base.items() if k not in CREDENTIAL_VARS}
+        env.update(overlay)
+        return env
+
+    def fail_over(self, error, lost_s):
+        """Advance to the next candidate; returns the backoff delay or None."""
+        if self.attempt + 1 >= self.max_attempts:
+            return None
+        previous = self.current()
+        self.attempt += 1
+        delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** (self.attempt - 1))
+        delay = round(delay * random.uniform(0.8, 1.2), 1)
+        self.time_lost_s += lost_s + delay
+        event = {
+            "attempt": self.attempt + 1,
+            "error": error,
+            "from": {"provider": previous[0], "model": previous[1]},
+            "to": {"provider": self.current()[0], "model": self.current()[1]},
+            "retryDelaySeconds": delay,
+        }
+        self.failovers.append(event)
+        return delay
+
+    def report(self):
+        return {
+            "attempts": self.attempt + 1,
+            "failovers": self.failovers,
+            "timeLostSeconds": round(self.time_lost_s, 1),
+        }
+
+
+def retryable_error(result, stderr_tail):
+    """Return the matched error text if a CLI run failed in a retryable way."""
+    if result is not None and not result.get("is_error"):
+        return None
+    text = " ".join(stderr_tail)
+    if result is not None:
+        text = "%s %s" % (result.get("result") or result.get("subtype") or "", text)
+    match = RETRYABLE_ERROR.search(text)
+    return match.group(0) if match else None
+
+
+def run_cli(cmd, env, current):
+    """Run one CLI launch, relaying stdout; returns what the router needs.
+
+    current["process"] always points at the live process so the SIGTERM
+    handler can reach it across relaunches.
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd="/workspace",
+        env=env,
+        text=True,
+        bufsize=1,
+        start_new_session=True,
+    )
+    current["process"] = process
+    stderr_tail = collections.deque(maxlen=20)
+
+    # Drain stderr in background
+    def _drain_stderr(proc):
+        for line in proc.stderr:
+            stderr_tail.append(line.strip())
+            print("[claude-stderr] %s" % line, end="", file=sys.stderr)
+
+    stderr_thread = threading.Thread(
+        target=_drain_stderr, args=(process,), daemon=True
+    )
+    stderr_thread.start()
+
+    session_id, result = None, None
+    for line in process.stdout:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        if '"session_id"' in line:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            session_id = msg.get("session_id") or session_id
+            if msg.get("type") == "result":
+                result = msg
+
+    process.wait()
+    stderr_thread.join(timeout=5)
+    if process.returncode != 0:
+        print(
+            "Claude CLI exited with code %s" % process.returncode,
+            file=sys.stderr,
+        )
+    return {
+        "session_id": session_id,
+        "result": result,
+        "stderr_tail": list(stderr_tail),
+    }
+
+
+def finish_if_stopped():
+    """After an early stop, let treemux-report commit, push and report."""
+    if not os.path.exists(STOP_FILE):
+        return
+    with open(STOP_FILE) as f:
+        reason = f.read().strip() or "stopped"
+    state = {}
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+    if state.get("done"):
+        return
+
+    print("Stopped early (%s), finalizing" % reason, file=sys.stderr)
+    try:
+        subprocess.run(
+            ["treemux-report", "done", "--stopped", reason],
+            cwd="/workspace", timeout=STOP_FLUSH_TIMEOUT_S,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print("treemux-report done failed: %s" % e, file=sys.stderr)
 
 
 def main():
@@ -106,12 +608,15 @@ def main():
 
     ctx = json.loads(sys.argv[1])
     challenge_doc = ctx["challenge_doc"]
-    challenge_doc += "\nStart thinking about what to build then build it. You have full autonomy to execute."
     worker_profile = ctx.get("worker_profile", "")
     model = ctx.get("model")
+    prompt_cache = ctx.get("prompt_cache", True)
 
     os.makedirs("/workspace", exist_ok=True)
 
+    # ── Project template ──
+    template = prepare_template(ctx.get("template"))
+
     # ── Git setup ──
     repo_url = os.environ.get("REPO_URL", "")
     github_token = os.environ.get("GITHUB_TOKEN", "")
@@ -169,6 +674,12 @@ def main():
                 ["git", "config", "user.name", git_user_name],
                 cwd="/workspace", check=True, capture_output=True,
             )
+            # Cache untracked-directory scans so per-step `git status` only
+            # revisits directories whose mtime changed.
+            subprocess.run(
+                ["git", "config", "core.untrackedCache", "true"],
+                cwd="/workspace", check=True, capture_output=True,
+            )
             subprocess.run(
                 ["git", "branch", "-M", branch],
                 cwd="/workspace", check=True, capture_output=True,
@@ -200,7 +711,10 @@ def main():
         json.dump(claude_json, f)
 
     # ── System prompt ──
-    system_prompt = build_system_prompt(worker_profile)
+    system_prompt = build_system_prompt(
+        challenge_doc, template["stack"] if template else None,
+    )
+    user_prompt = build_user_prompt(worker_profile)
 
     prompt_fd, prompt_path = tempfile.mkstemp(suffix=".txt")
     with os.fdopen(prompt_fd, "w") as f:
@@ -208,60 +722,110 @@ def main():
 
     prompt_fd2, prompt_doc_path = tempfile.mkstemp(suffix=".txt")
     with os.fdopen(prompt_fd2, "w") as f:
-        f.write(challenge_doc)
-
-    print("Starting Claude CLI (prompt: %d chars)" % len(challenge_doc), file=sys.stderr)
-
-    try:
-        model_flag = f"--model {model} " if model else ""
-        cmd = [
-            "bash", "-c",
-            "cat %s | claude -p "
-            "--output-format stream-json "
-            "--verbose "
-            "--append-system-prompt-file %s "
-            "--dangerously-skip-permissions "
-            "%s" % (prompt_doc_path, prompt_path, model_flag),
-        ]
-
-        env = os.environ.copy()
-        env["NO_COLOR"] = "1"
-
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd="/workspace",
-            env=env,
-            text=True,
-            bufsize=1,
-        )
-
-        # Drain stderr in background
-        import threading
-
-        def _drain_stderr(proc):
-            for line in proc.stderr:
-                print("[claude-stderr] %s" % line, end="", file=sys.stderr)
-
-        stderr_thread = threading.Thread(
-            target=_drain_stderr, args=(process,), daemon=True
-        )
-        stderr_thread.start()
+        f.write(user_prompt)
+
+    # Identical hashes across a task's workers mean the prefix is cacheable
+    print(
+        "Starting Claude CLI (system: %d chars sha=%s, user: %d chars, prompt cache: %s)" % (
+            len(system_prompt),
+            hashlib.sha256(system_prompt.encode()).hexdigest()[:12],
+            len(user_prompt),
+            "on" if prompt_cache else "off",
+        ),
+        file=sys.stderr,
+    )
+
+    sampler = ResourceSampler()
+    sampler.start()
+
+    router = ProviderRouter(
+        os.environ, os.environ.get("JOB_ID", ""), model,
+        ctx.get("fallback_models") or [], int(ctx.get("max_attempts") or MAX_ATTEMPTS),
+    )
+    current = {}
+    stopping = threading.Event()
+
+    # On a graceful stop, take down the whole CLI process group; the
+    # stdout loop then drains and we finalize normally. The event also
+    # cuts short a failover backoff.
+    def _forward_sigterm(signum, frame):
+        stopping.set()
+        try:
+            os.killpg(current["process"].pid, signal.SIGTERM)
+        except (KeyError, ProcessLookupError):
+            pass
 
-        for line in process.stdout:
-            sys.stdout.write(line)
-            sys.stdout.flush()
+    signal.signal(signal.SIGTERM, _forward_sigterm)
 
-        process.wait()
+    base_env = os.environ.copy()
+    base_env["NO_COLOR"] = "1"
+    if not prompt_cache:
+        base_env["DISABLE_PROMPT_CACHING"] = "1"
 
-        if process.returncode != 0:
+    try:
+        session_id = None
+        while True:
+            if stopping.is_set() or os.path.exists(STOP_FILE):
+                break
+            provider, attempt_model = router.current()
+            model_flag = f"--model {attempt_model} " if attempt_model else ""
+            resume_flag = f"--resume {session_id} " if session_id else ""
+            cmd = [
+                "bash", "-c",
+                "cat %s | claude -p "
+                "--output-format stream-json "
+                "--verbose "
+                "--append-system-prompt-file %s "
+                "--dangerously-skip-permissions "
+                "%s%s" % (prompt_doc_path, prompt_path, model_flag, resume_flag),
+            ]
             print(
-                "Claude CLI exited with code %s" % process.returncode,
+                "Launching Claude CLI (attempt %d, provider=%s, model=%s%s)" % (
+                    router.attempt + 1, provider, attempt_model or "default",
+                    ", resuming %s" % session_id if session_id else "",
+                ),
                 file=sys.stderr,
             )
 
+            started = time.monotonic()
+            outcome = run_cli(cmd, router.env(base_env), current)
+            error = retryable_error(outcome["result"], outcome["stderr_tail"])
+            if not error or os.path.exists(STOP_FILE):
+                break
+
+            # A resumable session keeps its work; otherwise the attempt is lost
+            resumable = outcome["session_id"] or session_id
+            lost_s = 0 if resumable else time.monotonic() - started
+            delay = router.fail_over(error, lost_s)
+            if delay is None:
+                print("Provider error %r, out of attempts" % error, file=sys.stderr)
+                break
+            event = router.failovers[-1]
+            print("Provider error %r, failing over in %ss: %s -> %s" % (
+                error, delay, event["from"], event["to"],
+            ), file=sys.stderr)
+            update_state(providerRetries=router.report())
+            post_callback("/v1.0/log/error", {
+                "taskId": os.environ.get("TASK_ID", ""),
+                "jobId": os.environ.get("JOB_ID", ""),
+                "error": "provider error: %s" % error,
+                "phase": "provider_failover",
+                "failover": event,
+                "timeLostSeconds": round(router.time_lost_s, 1),
+            })
+
+            session_id = resumable
+            if session_id:
+                with open(prompt_doc_path, "w") as f:
+                    f.write(RESUME_PROMPT)
+            stopping.wait(delay)
+
+        sampler.stop()
+        finish_if_stopped()
+
     finally:
+        if sampler.is_alive():
+            sampler.stop()
         os.unlink(prompt_path)
         os.unlink(prompt_doc_path)
 
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+replay_stream: replay recorded agent stdout through stream_agent_output.
+
+Recordings are written by implementation_worker.StreamRecorder (jobs
+triggered with "record_stream": true) to the `treemux-traces` Modal volume
+as <task_id>/<job_id>.stdout.gz. Each file is fed at full speed through
+stream_agent_output with ToolTrace, JobProgress and JobMetrics attached and logging
+silenced, and the run reports parse throughput, messages by type and peak
+memory.
+
+Usage:
+  modal volume get treemux-traces / ./traces
+  python scripts/replay_stream.py ./traces
+  python scripts/replay_stream.py ./traces --json > baseline.json
+  python scripts/replay_stream.py ./traces --baseline baseline.json
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import implementation_worker as worker  # noqa: E402
+
+
+class _Replay:
+    """Stand-in for a sandbox process whose stdout is a recording."""
+
+    def __init__(self, lines):
+        self.stdout = lines
+
+
+def find_recordings(paths):
+    """Expand files and directories into a sorted list of recordings."""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        for dirpath, _, files in os.walk(path):
+            for name in files:
+                if name.endswith(".stdout.gz"):
+                    found.append(os.path.join(dirpath, name))
+    return sorted(found)
+
+
+def load(paths):
+    """Read all recordings into memory so replay measures parsing only."""
+    lines = []
+    for path in paths:
+        with gzip.open(path, "rt") as f:
+            lines.extend(f)
+    return lines
+
+
+def replay(lines):
+    """Run lines through stream_agent_output; return counts and consumers."""
+    types = {}
+    parse = worker._try_parse_json
+
+    def counting_parse(line):
+        msg = parse(line)
+        key = msg.get("type", "unknown") if isinstance(msg, dict) else "non_json"
+        types[key] = types.get(key, 0) + 1
+        return msg
+
+    log, worker._log = worker._log, lambda msg: None
+    worker._try_parse_json = counting_parse
+    trace, progress = worker.ToolTrace(), worker.JobProgress()
+    try:
+        start = time.perf_counter()
+        worker.stream_agent_output(
+            _Replay(lines), trace=trace, progress=progress, metrics=worker.JobMetrics(),
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        worker._log, worker._try_parse_json = log, parse
+        with tempfile.TemporaryDirectory() as tmp:
+            trace.close(os.path.join(tmp, "trace.jsonl.gz"))
+    return elapsed, types, progress
+
+
+def run(lines, repeat):
+    """Best-of-N throughput, then one traced pass for peak memory."""
+    best, types, progress = None, {}, None
+    for _ in range(repeat):
+        elapsed, types, progress = replay(lines)
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    replay(lines)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total_bytes = sum(len(line) for line in lines)
+    return {
+        "lines": len(lines),
+        "mb": round(total_bytes / 1e6, 2),
+        "seconds": round(best, 4),
+        "lines_per_s": round(len(lines) / best) if best else None,
+        "mb_per_s": round(total_bytes / 1e6 / best, 2) if best else None,
+        "peak_mb": round(peak / 1e6, 2),
+        "types": dict(sorted(types.items())),
+        "progress": {
+            "tool_calls": progress.tool_calls,
+            "tool_errors": progress.tool_errors,
+            "steps": progress.steps,
+            "builds": progress.builds,
+            "build_errors": progress.build_errors,
+        },
+    }
+
+
+def compare(report, baseline, max_slowdown):
+    """Return a list of regressions against a previous --json report."""
+    problems = []
+    if baseline.get("lines") != report["lines"]:
+        problems.append("recordings differ from baseline (%s vs %s lines)" % (
+            report["lines"], baseline.get("lines")))
+        return problems
+    for key in ("types", "progress"):
+        if baseline.get(key) != report[key]:
+            problems.append("%s changed: %s -> %s" % (key, baseline.get(key), report[key]))
+    if baseline.get("lines_per_s") and report["lines_per_s"]:
+        ratio = report["lines_per_s"] / baseline["lines_per_s"]
+        if ratio < 1 - max_slowdown:
+            problems.append("throughput %d lines/s is %.0f%% below baseline %d" % (
+                report["lines_per_s"], (1 - ratio) * 100, baseline["lines_per_s"]))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="replay_stream",
+        description="Replay recorded agent stdout through stream_agent_output",
+    )
+    parser.add_argument("paths", nargs="+", help="Recordings or directories containing them")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes (best is reported)")
+    parser.add_argument("--json", action="store_true", help="Emit JSON instead of text")
+    parser.add_argument("--baseline", help="Previous --json report to compare against")
+    parser.add_argument(
+        "--max-slowdown", type=float, default=0.2,
+        help="Allowed throughput drop vs baseline (fraction)",
+    )
+    args = parser.parse_args()
+
+    paths = find_recordings(args.paths)
+    if not paths:
+        print("no recordings found under %s" % " ".join(args.paths), file=sys.stderr)
+        sys.exit(1)
+
+    report = run(load(paths), max(1, args.repeat))
+    report["recordings"] = len(paths)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("%d recordings, %d lines (%s MB)" % (len(paths), report["lines"], report["mb"]))
+        print("parse: %ss  %s lines/s  %s MB/s  peak %s MB" % (
+            report["seconds"], report["lines_per_s"], report["mb_per_s"], report["peak_mb"]))
+        width = max(len(t) for t in report["types"]) if report["types"] else 0
+        for msg_type, count in report["types"].items():
+            print("  %s  %d" % (msg_type.ljust(width), count))
+        print("progress: %s" % json.dumps(report["progress"]))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(report, json.load(f), args.max_slowdown)
+        for problem in problems:
+            print("REGRESSION: %s" % problem, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
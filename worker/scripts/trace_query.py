@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+trace_query: offline queries over per-job tool-call traces.
+
+Traces are written by implementation_worker.ToolTrace to the
+`treemux-traces` Modal volume as <task_id>/<job_id>.jsonl.gz.
+
+Usage:
+  modal volume get treemux-traces / ./traces
+  python scripts/trace_query.py ./traces --last 500
+  python scripts/trace_query.py ./traces --last 500 --sort errors --json
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _started(path):
+    """Timestamp of a trace's first record (0 if empty or unreadable)."""
+    try:
+        with gzip.open(path, "rt") as f:
+            return json.loads(f.readline()).get("ts", 0)
+    except (OSError, ValueError, EOFError):
+        return 0
+
+
+def find_traces(root, last):
+    """Return the trace files of the `last` most recently run jobs under root.
+
+    Jobs are ordered by their first record's ts; file mtimes reflect when
+    the volume was downloaded, not when the job ran.
+    """
+    paths = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if name.endswith(".jsonl.gz"):
+                paths.append(os.path.join(dirpath, name))
+    paths.sort(key=_started)
+    return paths[-last:] if last else paths
+
+
+def aggregate(paths):
+    """Aggregate trace records per tool."""
+    tools = {}
+    for path in paths:
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                record = json.loads(line)
+                agg = tools.setdefault(record["tool"], {
+                    "calls": 0, "errors": 0, "unfinished": 0,
+                    "durations": [], "out_bytes": 0, "jobs": set(),
+                })
+                agg["calls"] += 1
+                agg["jobs"].add(path)
+                if record.get("ms") is None:
+                    agg["unfinished"] += 1
+                    continue
+                agg["durations"].append(record["ms"])
+                agg["errors"] += 1 if record.get("err") else 0
+                agg["out_bytes"] += record.get("out_bytes") or 0
+
+    rows = []
+    for tool, agg in tools.items():
+        durations = agg["durations"]
+        rows.append({
+            "tool": tool,
+            "calls": agg["calls"],
+            "jobs": len(agg["jobs"]),
+            "wall_s": round(sum(durations) / 1000, 1),
+            "p50_ms": _percentile(durations, 50),
+            "p95_ms": _percentile(durations, 95),
+            "errors": agg["errors"],
+            "error_rate": round(agg["errors"] / len(durations), 3) if durations else None,
+            "unfinished": agg["unfinished"],
+            "out_mb": round(agg["out_bytes"] / 1e6, 2),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="trace_query",
+        description="Aggregate tool-call traces across jobs",
+    )
+    parser.add_argument("root", help="Directory containing downloaded traces")
+    parser.add_argument("--last", type=int, default=500, help="Most recent N jobs (0 = all)")
+    parser.add_argument(
+        "--sort", default="wall_s",
+        choices=["wall_s", "calls", "p95_ms", "errors", "out_mb"],
+        help="Column to sort by (descending)",
+    )
+    parser.add_argument("--top", type=int, default=20, help="Rows to print")
+    parser.add_argument("--json", action="store_true", help="Emit JSON instead of a table")
+    args = parser.parse_args()
+
+    paths = find_traces(args.root, args.last)
+    if not paths:
+        print("no traces found under %s" % args.root, file=sys.stderr)
+        sys.exit(1)
+
+    rows = aggregate(paths)
+    rows.sort(key=lambda r: r[args.sort] or 0, reverse=True)
+    rows = rows[:args.top]
+
+    if args.json:
+        print(json.dumps({"jobs": len(paths), "tools": rows}, indent=2))
+        return
+
+    print("%d jobs" % len(paths))
+    columns = ["tool", "calls", "jobs", "wall_s", "p50_ms", "p95_ms", "error_rate", "unfinished", "out_mb"]
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    main()
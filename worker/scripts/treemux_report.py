@@ -7,21 +7,70 @@ Usage:
   treemux-report start --idea "Real-time collab editor" --steps "Scaffold" "Build backend" "Create UI"
   treemux-report step --index 1 --summary "Scaffold project"
   treemux-report done
+  treemux-report done --stopped pruned   (runner only)
 
 Environment variables:
   TASK_ID, JOB_ID, CALLBACK_BASE_URL, BRANCH, REPO_URL, GITHUB_TOKEN,
-  VERCEL_TOKEN, GIT_USER_NAME, GIT_USER_EMAIL
+  VERCEL_TOKEN, GIT_USER_NAME, GIT_USER_EMAIL, TREEMUX_MAX_FILE_BYTES,
+  TREEMUX_ARTIFACTS, TREEMUX_ARTIFACT_STORE, TREEMUX_ARTIFACT_URI_PREFIX,
+  TREEMUX_ARTIFACT_MAX_BYTES, TREEMUX_DONE_CHECK_BUDGET_S, TREEMUX_VERIFY,
+  TREEMUX_VERIFY_BUDGET_S, TREEMUX_PROBE_ROUTES
 """
 import argparse
+import hashlib
 import json
 import os
 import re
+import shutil
+import signal
+import socket
 import subprocess
+import tempfile
+import time
+import urllib.error
 import urllib.request
 
 STATE_FILE = "/tmp/.treemux-state.json"
+RESOURCES_FILE = "/tmp/.treemux-resources.json"  # written by runner.py
 WORK_DIR = "/workspace"
 
+# Commit policy: files above this size (override with TREEMUX_MAX_FILE_BYTES)
+# and generated caches/artifacts are diverted out of step commits.
+MAX_FILE_BYTES = 5 * 1024 * 1024
+# Tool output directories, wherever they appear (e.g. per-package in a monorepo)
+GENERATED_DIRS = {
+    "node_modules", ".next", ".turbo", ".vercel", ".cache", ".parcel-cache",
+    ".svelte-kit", ".nuxt", ".output", "__pycache__", ".venv",
+}
+# Names that are also plausible source directories (e.g. a Next.js route
+# src/app/coverage/), so they only count as generated at the repo root
+GENERATED_ROOT_DIRS = {"coverage"}
+GENERATED_SUFFIXES = (
+    ".log", ".tsbuildinfo", ".pyc", ".tar", ".tgz", ".gz", ".zip", ".7z",
+)
+
+# Done-stage artifacts: a content-addressed tarball per job in
+# TREEMUX_ARTIFACT_STORE (a directory, or an http(s) URL to PUT to)
+ARTIFACT_STORE = "/tmp/treemux-artifacts"
+ARTIFACT_MAX_BYTES = 200 * 1024 * 1024
+BUILD_OUTPUT_DIRS = ("dist", "out", ".next")
+# package.json scripts run at done; they must finish within this many
+# seconds of `done` starting (the push counts too) so the agent's Bash
+# tool call does not time out
+DONE_CHECKS = ("build", "lint", "test")
+DONE_CHECK_BUDGET_S = 75
+
+# Step verification: build a mirror of the workspace (leaving the agent's
+# dev server and its .next alone), start it on a free port and probe
+# TREEMUX_PROBE_ROUTES (comma-separated) before deploying. Everything,
+# push included, must finish within VERIFY_BUDGET_S of the step starting
+# so the agent's Bash tool call does not time out.
+VERIFY_DIR = "/tmp/treemux-verify"
+VERIFY_BUDGET_S = 80
+VERIFY_START_TIMEOUT_S = 20
+VERIFY_PROBE_TIMEOUT_S = 5
+PROBE_ROUTES = ("/",)
+
 
 def _env(key, default=""):
     return (os.environ.get(key) or default).strip()
@@ -48,6 +97,7 @@ def _post(path, body):
         _log("POST %s ok" % path)
     except Exception as e:
         _log("POST %s error: %s" % (path, e))
+        _record_metric("callbackFailures", 1)
 
 
 def _load_state():
@@ -62,38 +112,186 @@ def _save_state(state):
         json.dump(state, f)
 
 
+def _record_metric(name, value):
+    """Add to a counter (number) or series (list) under state["metrics"].
+
+    The worker reads these when the job ends and publishes them with the
+    job's fleet metrics.
+    """
+    state = _load_state()
+    metrics = state.setdefault("metrics", {})
+    if isinstance(value, list):
+        metrics[name] = (metrics.get(name) or []) + value
+    else:
+        metrics[name] = (metrics.get(name) or 0) + value
+    _save_state(state)
+
+
+def _git(*args, **kwargs):
+    return subprocess.run(
+        ["git"] + list(args), cwd=WORK_DIR, capture_output=True, **kwargs
+    )
+
+
+def _changed_paths():
+    """List (path, in_worktree) for paths that differ from the index or HEAD.
+
+    `git status` only re-hashes files whose stat data changed since the last
+    index refresh, so this stays cheap on large trees. in_worktree is False
+    for changes that are already staged and need no further `git add`.
+    """
+    out = _git(
+        "status", "--porcelain=v1", "-z", "--untracked-files=all", check=True,
+    ).stdout.decode("utf-8", "surrogateescape")
+    fields = out.split("\0")
+    paths = []
+    i = 0
+    while i < len(fields):
+        entry = fields[i]
+        i += 1
+        if len(entry) < 4:
+            continue
+        status, path = entry[:2], entry[3:]
+        paths.append((path, status[1] != " "))
+        if status[0] in "RC":
+            # Renames/copies carry their (already staged) source as the next field
+            i += 1
+    return paths
+
+
+def _divert(path, max_bytes):
+    """Return (exclude_pattern, reason) if path must stay out of the commit."""
+    parts = path.split("/")
+    if len(parts) > 1 and parts[0] in GENERATED_ROOT_DIRS:
+        return "/%s/" % parts[0], "generated"
+    for depth, part in enumerate(parts[:-1]):
+        if part in GENERATED_DIRS:
+            return "/%s/" % "/".join(parts[:depth + 1]), "generated"
+    if path.endswith(GENERATED_SUFFIXES):
+        return "/" + path, "generated"
+    try:
+        size = os.lstat(os.path.join(WORK_DIR, path)).st_size
+    except FileNotFoundError:
+        return None, None
+    if size > max_bytes:
+        return "/" + path, "too large (%d bytes)" % size
+    return None, None
+
+
+def _exclude(patterns):
+    """Append patterns to .git/info/exclude so git stops scanning them."""
+    path = os.path.join(WORK_DIR, ".git", "info", "exclude")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    existing = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            existing = set(f.read().splitlines())
+    with open(path, "a") as f:
+        for pattern in patterns:
+            if pattern not in existing:
+                f.write(pattern + "\n")
+
+
+def _stage_changes():
+    """Stage changed paths that pass the size/type policy.
+
+    Returns the number of files and bytes staged, and a {pattern: reason}
+    dict of every path diverted so far. Excluded paths no longer show up
+    as changes, so earlier diversions are kept in the state file to be
+    reported on every step.
+    """
+    max_bytes = int(_env("TREEMUX_MAX_FILE_BYTES", str(MAX_FILE_BYTES)))
+    staged, diverted, unstage = [], {}, []
+    total = 0
+    for path, in_worktree in _changed_paths():
+        pattern, reason = _divert(path, max_bytes)
+        if pattern:
+            diverted[pattern] = reason
+            unstage.append(path)
+            continue
+        if in_worktree:
+            staged.append(path)
+        full = os.path.join(WORK_DIR, path)
+        if os.path.isfile(full) and not os.path.islink(full):
+            total += os.path.getsize(full)
+
+    env = dict(os.environ, GIT_LITERAL_PATHSPECS="1")
+    if diverted:
+        _exclude(sorted(diverted))
+        # Exclude rules don't apply to paths already in the index (a manual
+        # `git add -A`, or files tracked earlier), so drop those explicitly
+        _git(
+            "rm", "--cached", "-r", "--quiet", "--ignore-unmatch",
+            "--pathspec-from-file=-", "--pathspec-file-nul",
+            input="\0".join(unstage).encode("utf-8", "surrogateescape"),
+            env=env, check=True,
+        )
+    if staged:
+        _git(
+            "add", "-A", "--pathspec-from-file=-", "--pathspec-file-nul",
+            input="\0".join(staged).encode("utf-8", "surrogateescape"),
+            env=env, check=True,
+        )
+
+    state = _load_state()
+    known = dict(state.get("diverted") or {})
+    known.update(diverted)
+    if diverted:
+        state["diverted"] = known
+        _save_state(state)
+    for pattern, reason in sorted(known.items()):
+        _log("diverted %s: %s%s" % (pattern, reason, "" if pattern in diverted else " (earlier step)"))
+    return len(staged), total, known
+
+
 def _git_commit_and_push(message):
-    """Stage all, commit, push --force."""
+    """Stage changed paths, commit and push --force.
+
+    Skips the commit and push entirely when the tree is unchanged and HEAD is
+    already on the remote. Returns a stats dict (or None if git is not set up).
+    """
     branch = _env("BRANCH", "main")
     repo_url = _env("REPO_URL")
     github_token = _env("GITHUB_TOKEN")
 
     if not repo_url or not github_token:
         _log("no REPO_URL or GITHUB_TOKEN, skipping git push")
-        return
+        return None
 
     push_url = repo_url.replace(
         "https://", "https://x-access-token:%s@" % github_token
     )
+    stats = {
+        "files": 0, "bytes": 0, "diverted": {},
+        "pushed": False, "unchanged": False,
+    }
 
     try:
-        subprocess.run(
-            ["git", "remote", "set-url", "origin", push_url],
-            cwd=WORK_DIR, capture_output=True,
-        )
-        subprocess.run(
-            ["git", "add", "-A"],
-            cwd=WORK_DIR, check=True, capture_output=True,
-        )
-        subprocess.run(
-            ["git", "commit", "-m", message[:72], "--allow-empty"],
-            cwd=WORK_DIR, check=True, capture_output=True,
+        _git("remote", "set-url", "origin", push_url)
+        stats["files"], stats["bytes"], stats["diverted"] = _stage_changes()
+
+        if _git("diff", "--cached", "--quiet").returncode != 0:
+            _git("commit", "-m", message[:72], check=True)
+        else:
+            head = _git("rev-parse", "--verify", "-q", "HEAD").stdout.strip()
+            remote = _git(
+                "rev-parse", "--verify", "-q", "refs/remotes/origin/%s" % branch,
+            ).stdout.strip()
+            if not head or head == remote:
+                _log("tree unchanged, skipping commit and push")
+                stats["unchanged"] = True
+                return stats
+
+        start = time.monotonic()
+        _git(
+            "push", "--force", "-u", "origin", branch,
+            check=True, timeout=120,
         )
-        subprocess.run(
-            ["git", "push", "--force", "-u", "origin", branch],
-            cwd=WORK_DIR, check=True, capture_output=True, timeout=120,
-        )
-        _log("pushed: %s" % message[:72])
+        _record_metric("pushSeconds", [round(time.monotonic() - start, 2)])
+        stats["pushed"] = True
+        _log("pushed: %s (%d files, %d bytes staged)" % (
+            message[:72], stats["files"], stats["bytes"],
+        ))
     except subprocess.CalledProcessError as e:
         stderr = (e.stderr or b"").decode(errors="replace").strip()
         _log("git error: %s stderr=%s" % (e, stderr))
@@ -104,6 +302,7 @@ def _git_commit_and_push(message):
             "stderr": stderr,
             "phase": "git_push",
         })
+    return stats
 
 
 def _trigger_vercel_deploy():
@@ -153,6 +352,337 @@ def _trigger_vercel_deploy():
         _log("Vercel deploy trigger failed: %s" % e)
 
 
+def _dir_size(path):
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _workspace_files():
+    """Return {path: size} for files git would track in the workspace."""
+    out = _git("ls-files", "-z", "--cached", "--others", "--exclude-standard")
+    if out.returncode == 0:
+        paths = [p for p in out.stdout.decode("utf-8", "surrogateescape").split("\0") if p]
+    else:
+        paths = []
+        for dirpath, dirs, files in os.walk(WORK_DIR):
+            dirs[:] = [
+                d for d in dirs
+                if d not in GENERATED_DIRS and d != ".git"
+                and not (dirpath == WORK_DIR and d in GENERATED_ROOT_DIRS)
+            ]
+            for name in files:
+                paths.append(os.path.relpath(os.path.join(dirpath, name), WORK_DIR))
+    files = {}
+    for path in sorted(paths):
+        try:
+            files[path] = os.lstat(os.path.join(WORK_DIR, path)).st_size
+        except OSError:
+            pass
+    return files
+
+
+def _package_scripts():
+    """Return the workspace package.json scripts, or None without one."""
+    try:
+        with open(os.path.join(WORK_DIR, "package.json")) as f:
+            return json.load(f).get("scripts") or {}
+    except (OSError, ValueError):
+        return None
+
+
+def _output_size(name, root=WORK_DIR):
+    """Size of a build output directory, excluding its cache."""
+    path = os.path.join(root, name)
+    return _dir_size(path) - _dir_size(os.path.join(path, "cache"))
+
+
+def _run_checks(log_dir, deadline):
+    """Run the project's build/lint/test scripts until deadline, logging to log_dir."""
+    scripts = _package_scripts()
+    if not scripts:
+        return {}
+    results = {}
+    for name in DONE_CHECKS:
+        if name not in scripts:
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            results[name] = {"status": "skipped"}
+            continue
+        start = time.monotonic()
+        with open(os.path.join(log_dir, "%s.log" % name), "w") as log:
+            try:
+                proc = subprocess.run(
+                    ["bun", "run", name], cwd=WORK_DIR,
+                    stdout=log, stderr=subprocess.STDOUT,
+                    env=dict(os.environ, CI="1"), timeout=remaining,
+                )
+                status = "passed" if proc.returncode == 0 else "failed"
+            except subprocess.TimeoutExpired:
+                status = "timeout"
+            except OSError as e:
+                log.write(str(e))
+                status = "error"
+        results[name] = {"status": status, "seconds": round(time.monotonic() - start, 1)}
+    return results
+
+
+def _store_blob(path, name):
+    """Put a blob in the artifact store and return its URI."""
+    store = _env("TREEMUX_ARTIFACT_STORE", ARTIFACT_STORE)
+    if store.startswith(("http://", "https://")):
+        url = store.rstrip("/") + "/" + name
+        with open(path, "rb") as f:
+            req = urllib.request.Request(
+                url, data=f, method="PUT",
+                headers={"Content-Length": str(os.path.getsize(path))},
+            )
+            urllib.request.urlopen(req, timeout=120)
+        return url
+    os.makedirs(store, exist_ok=True)
+    dest = os.path.join(store, name)
+    if not os.path.exists(dest):
+        shutil.copyfile(path, dest + ".tmp")
+        os.replace(dest + ".tmp", dest)
+        # Flushes the write through when the store is a mounted volume
+        os.sync()
+    prefix = _env("TREEMUX_ARTIFACT_URI_PREFIX")
+    return prefix + name if prefix else "file://" + dest
+
+
+def _package_artifacts(deadline=None):
+    """Build the done manifest and upload the artifacts as one blob.
+
+    The blob (zstd when available, else gzip) holds the manifest, check
+    logs, PITCH.md and build output; it is named by its sha256. Without a
+    check deadline (a stopped run) checks and build output are skipped to
+    keep the blob small. Returns (manifest, artifact reference).
+    """
+    staging = tempfile.mkdtemp(prefix="treemux-artifacts-")
+    try:
+        files = _workspace_files()
+        manifest = {
+            "files": files,
+            "fileCount": len(files),
+            "totalBytes": sum(files.values()),
+            "checks": _run_checks(staging, deadline) if deadline else {},
+        }
+
+        budget = int(_env("TREEMUX_ARTIFACT_MAX_BYTES", str(ARTIFACT_MAX_BYTES)))
+        outputs = []
+        for name in BUILD_OUTPUT_DIRS if deadline else ():
+            if not os.path.isdir(os.path.join(WORK_DIR, name)):
+                continue
+            size = _output_size(name)
+            if size > budget:
+                _log("artifact: skipping %s/ (%d bytes over budget)" % (name, size))
+                continue
+            budget -= size
+            outputs.append(name)
+        manifest["buildOutputs"] = outputs
+
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        if os.path.exists(os.path.join(WORK_DIR, "PITCH.md")):
+            shutil.copyfile(os.path.join(WORK_DIR, "PITCH.md"), os.path.join(staging, "PITCH.md"))
+
+        compression, suffix = ("zstd", "tar.zst") if shutil.which("zstd") else ("gzip", "tar.gz")
+        blob = staging + "." + suffix
+        cmd = ["tar", "--zstd" if compression == "zstd" else "-z", "-cf", blob,
+               "--exclude=.next/cache", "-C", staging, "."]
+        if outputs:
+            cmd += ["-C", WORK_DIR] + outputs
+        subprocess.run(cmd, check=True, capture_output=True)
+
+        sha = hashlib.sha256()
+        with open(blob, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        size = os.path.getsize(blob)
+        try:
+            uri = _store_blob(blob, "%s.%s" % (digest, suffix))
+        finally:
+            os.unlink(blob)
+        _log("artifacts: %d bytes (%s) -> %s" % (size, compression, uri))
+        return manifest, {"sha256": digest, "bytes": size, "compression": compression, "uri": uri}
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, proc, timeout):
+    """Wait until something listens on port; False if proc exits first."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.25)
+    return False
+
+
+def _probe(port, route, timeout):
+    """GET a route and time the first response."""
+    start = time.monotonic()
+    try:
+        resp = urllib.request.urlopen("http://127.0.0.1:%d%s" % (port, route), timeout=timeout)
+        status = resp.status
+        resp.close()
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception as e:
+        return {"route": route, "status": None, "ms": None, "error": str(e)}
+    return {"route": route, "status": status, "ms": round((time.monotonic() - start) * 1000)}
+
+
+def _mirror_workspace():
+    """Refresh VERIFY_DIR from the workspace sources.
+
+    Build output in the mirror is kept between steps as a build cache, and
+    node_modules is hard-linked (symlinked across filesystems, which some
+    bundlers reject) so the copy stays cheap.
+    """
+    os.makedirs(VERIFY_DIR, exist_ok=True)
+    keep = set(BUILD_OUTPUT_DIRS)
+    for name in os.listdir(VERIFY_DIR):
+        if name in keep:
+            continue
+        path = os.path.join(VERIFY_DIR, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+    skip = GENERATED_DIRS | GENERATED_ROOT_DIRS | keep | {".git"}
+    for name in os.listdir(WORK_DIR):
+        if name in skip:
+            continue
+        src, dest = os.path.join(WORK_DIR, name), os.path.join(VERIFY_DIR, name)
+        if os.path.isdir(src) and not os.path.islink(src):
+            shutil.copytree(src, dest, symlinks=True,
+                            ignore=shutil.ignore_patterns(*GENERATED_DIRS))
+        else:
+            shutil.copy2(src, dest, follow_symlinks=False)
+    modules = os.path.join(WORK_DIR, "node_modules")
+    if os.path.isdir(modules):
+        linked = subprocess.run(
+            ["cp", "-al", modules, os.path.join(VERIFY_DIR, "node_modules")],
+            capture_output=True,
+        )
+        if linked.returncode != 0:
+            shutil.rmtree(os.path.join(VERIFY_DIR, "node_modules"), ignore_errors=True)
+            os.symlink(modules, os.path.join(VERIFY_DIR, "node_modules"))
+
+
+def _verify_locally(deadline):
+    """Build the project, serve it and probe routes before deploying.
+
+    Runs in a mirror of the workspace until the monotonic deadline.
+    Returns the results with passed True/False, or passed None when the
+    checks were inconclusive (no start script, time budget exhausted);
+    only a definite failure blocks the deploy. Returns None when the
+    workspace has no build script.
+    """
+    scripts = _package_scripts()
+    if not scripts or "build" not in scripts:
+        return None
+    env = dict(os.environ, CI="1")
+    result = {"passed": None}
+    if deadline - time.monotonic() < 5:
+        result["build"] = {"status": "skipped"}
+        return result
+
+    start = time.monotonic()
+    try:
+        _mirror_workspace()
+        proc = subprocess.run(
+            ["bun", "run", "build"], cwd=VERIFY_DIR, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            timeout=max(1, deadline - time.monotonic()),
+        )
+    except subprocess.TimeoutExpired:
+        result["build"] = {"status": "timeout", "seconds": round(time.monotonic() - start, 1)}
+        return result
+    except (OSError, shutil.Error) as e:
+        result["build"] = {"status": "error", "error": str(e)}
+        return result
+    result["build"] = {
+        "status": "passed" if proc.returncode == 0 else "failed",
+        "seconds": round(time.monotonic() - start, 1),
+    }
+    if proc.returncode != 0:
+        # Shown to the agent so it can fix the build before the next step
+        tail = proc.stdout.decode(errors="replace")[-2000:]
+        _log("local build failed:\n%s" % tail)
+        result["passed"] = False
+        return result
+    result["bundleBytes"] = sum(
+        _output_size(name, VERIFY_DIR) for name in BUILD_OUTPUT_DIRS
+        if os.path.isdir(os.path.join(VERIFY_DIR, name))
+    )
+
+    serve = "start" if "start" in scripts else "preview" if "preview" in scripts else None
+    if serve is None:
+        return result
+    port = _free_port()
+    server = subprocess.Popen(
+        ["bun", "run", serve, "--port", str(port)], cwd=VERIFY_DIR,
+        env=dict(env, PORT=str(port)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        start = time.monotonic()
+        timeout = min(VERIFY_START_TIMEOUT_S, max(0, deadline - time.monotonic()))
+        if not _wait_for_port(port, server, timeout):
+            result["serve"] = {"status": "exited" if server.poll() is not None else "timeout"}
+            result["passed"] = False if server.poll() is not None else None
+            return result
+        result["serve"] = {"status": "listening", "seconds": round(time.monotonic() - start, 1)}
+
+        routes = [r.strip() for r in _env("TREEMUX_PROBE_ROUTES").split(",") if r.strip()]
+        result["routes"] = []
+        for route in routes or PROBE_ROUTES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                result["routes"].append({"route": route, "status": None, "ms": None, "error": "skipped"})
+                continue
+            result["routes"].append(_probe(port, route, min(VERIFY_PROBE_TIMEOUT_S, remaining)))
+        if any(r.get("error") == "skipped" for r in result["routes"]):
+            # Out of time: only a route that actually failed is conclusive
+            if any(r["status"] is not None and r["status"] >= 400 for r in result["routes"]):
+                result["passed"] = False
+        else:
+            result["passed"] = all(
+                r["status"] is not None and r["status"] < 400 for r in result["routes"]
+            )
+    finally:
+        if server.poll() is None:
+            try:
+                os.killpg(server.pid, signal.SIGTERM)
+                server.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                try:
+                    os.killpg(server.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+    return result
+
+
 def cmd_start(args):
     """Agent reports: here's my idea and plan."""
     job_id = _env("JOB_ID")
@@ -160,11 +690,13 @@ def cmd_start(args):
     idea = args.idea
     steps = args.steps or []
 
-    state = {
+    # Keep anything the runner recorded before the agent started
+    state = _load_state()
+    state.update({
         "idea": idea,
         "totalSteps": len(steps),
         "planSteps": steps,
-    }
+    })
     _save_state(state)
 
     _post("/v1.0/log/start", {
@@ -182,6 +714,7 @@ def cmd_start(args):
 
 def cmd_step(args):
     """Agent reports: finished a step."""
+    started = time.monotonic()
     job_id = _env("JOB_ID")
     branch = _env("BRANCH", "main")
     state = _load_state()
@@ -190,35 +723,62 @@ def cmd_step(args):
     summary = args.summary
 
     # Git commit + push
-    _git_commit_and_push("Step %s: %s" % (step_index, summary))
+    push = _git_commit_and_push("Step %s: %s" % (step_index, summary))
+    unchanged = push is not None and push["unchanged"]
+
+    # Local build + serve check, gating the deploy
+    verify = None
+    if not unchanged and _env("TREEMUX_VERIFY", "1") != "0":
+        verify = _verify_locally(
+            started + int(_env("TREEMUX_VERIFY_BUDGET_S", str(VERIFY_BUDGET_S))),
+        )
+        if verify is not None:
+            _save_state(dict(_load_state(), verify=verify))
 
     # Callback
-    _post("/v1.0/log/step", {
+    step_payload = {
         "taskId": _env("TASK_ID"),
         "jobId": job_id,
         "stepIndex": step_index,
         "totalSteps": total_steps,
         "done": False,
         "summary": summary,
-    })
+    }
+    if verify is not None:
+        step_payload["verify"] = verify
+    _post("/v1.0/log/step", step_payload)
+
+    if unchanged:
+        # Nothing new to push or deploy
+        _log("step %s/%s: %s (no changes)" % (step_index, total_steps, summary))
+        return
 
     # Push notification
-    _post("/v1.0/log/push", {
+    payload = {
         "taskId": _env("TASK_ID"),
         "jobId": job_id,
         "stepIndex": step_index,
         "branch": branch,
         "summary": summary,
-    })
+    }
+    if push is not None:
+        payload["filesStaged"] = push["files"]
+        payload["bytesStaged"] = push["bytes"]
+        payload["diverted"] = push["diverted"]
+    _post("/v1.0/log/push", payload)
 
     # Trigger Vercel deploy
-    _trigger_vercel_deploy()
+    if verify is not None and verify["passed"] is False:
+        _log("local verification failed, skipping deploy")
+    else:
+        _trigger_vercel_deploy()
 
     _log("step %s/%s: %s" % (step_index, total_steps, summary))
 
 
 def cmd_done(args):
     """Agent reports: all done."""
+    started = time.monotonic()
     job_id = _env("JOB_ID")
     branch = _env("BRANCH", "main")
     repo_url = _env("REPO_URL")
@@ -237,10 +797,13 @@ def cmd_done(args):
         _log("no PITCH.md found, using fallback pitch")
 
     # Final git commit + push
-    _git_commit_and_push("Final: complete build")
+    if args.stopped:
+        _git_commit_and_push("Final: stopped early (%s)" % args.stopped)
+    else:
+        _git_commit_and_push("Final: complete build")
 
     # Done callback
-    _post("/v1.0/log/done", {
+    payload = {
         "taskId": _env("TASK_ID"),
         "jobId": job_id,
         "repoUrl": repo_url or "",
@@ -249,11 +812,32 @@ def cmd_done(args):
         "success": True,
         "error": None,
         "branch": branch,
-    })
-
-    # Mark state as done
-    state["done"] = True
-    _save_state(state)
+    }
+    if _env("TREEMUX_ARTIFACTS", "1") != "0":
+        try:
+            # A stopped run must finish within runner.py's flush timeout
+            deadline = None if args.stopped else (
+                started + int(_env("TREEMUX_DONE_CHECK_BUDGET_S", str(DONE_CHECK_BUDGET_S)))
+            )
+            payload["manifest"], payload["artifact"] = _package_artifacts(deadline)
+        except Exception as e:
+            _log("artifact packaging failed: %s" % e)
+    if state.get("template"):
+        payload["template"] = state["template"]
+    if state.get("providerRetries"):
+        payload["providerRetries"] = state["providerRetries"]
+    if os.path.exists(RESOURCES_FILE):
+        with open(RESOURCES_FILE) as f:
+            payload["resources"] = json.load(f)
+    if args.stopped:
+        payload["stopped"] = args.stopped
+    if args.stopped == "cancelled":
+        payload["success"] = False
+        payload["error"] = "Cancelled"
+    _post("/v1.0/log/done", payload)
+
+    # Mark state as done (reloaded: metrics were recorded since the load above)
+    _save_state(dict(_load_state(), done=True))
 
     _log("done!")
 
@@ -276,7 +860,11 @@ def main():
     p_step.add_argument("--summary", required=True, help="Step summary")
 
     # done
-    sub.add_parser("done", help="Report completion")
+    p_done = sub.add_parser("done", help="Report completion")
+    p_done.add_argument(
+        "--stopped", metavar="REASON",
+        help="The worker was stopped early (used by the runner, not the agent)",
+    )
 
     args = parser.parse_args()
 